@@ -5,14 +5,20 @@ O simplemente: python manage.py runscript crear_datos_prueba (si tienes django-e
 """
 import os
 import sys
+from collections import Counter
+
 import django
 
 # Configurar Django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'redsocial.settings')
 django.setup()
 
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Q
 from usuarios.models import PerfilUsuario, Amistad, SolicitudAmistad
+from usuarios.graph_engine import invalidar_grafo, MotorRecomendaciones
 
 
 def crear_usuarios_prueba():
@@ -31,32 +37,49 @@ def crear_usuarios_prueba():
         {'username': 'miguel', 'first_name': 'Miguel', 'last_name': 'Díaz', 'email': 'miguel@test.com', 'bio': 'Full Stack Developer', 'ubicacion': 'Tijuana'},
     ]
     
-    usuarios_creados = []
-    
-    for data in usuarios_data:
-        user, created = User.objects.get_or_create(
-            username=data['username'],
-            defaults={
-                'first_name': data['first_name'],
-                'last_name': data['last_name'],
-                'email': data['email'],
-            }
-        )
+    usernames = [data['username'] for data in usuarios_data]
+    existentes = set(
+        User.objects.filter(username__in=usernames).values_list('username', flat=True)
+    )
+    nuevos_data = [data for data in usuarios_data if data['username'] not in existentes]
+    
+    # Todos comparten contraseña: se calcula el hash una sola vez
+    password = make_password('test1234')
+    
+    with transaction.atomic():
+        User.objects.bulk_create([
+            User(
+                username=data['username'],
+                first_name=data['first_name'],
+                last_name=data['last_name'],
+                email=data['email'],
+                password=password,
+            )
+            for data in nuevos_data
+        ], ignore_conflicts=True)
         
-        if created:
-            user.set_password('test1234')
-            user.save()
-            # Actualizar perfil
-            user.perfil.bio = data['bio']
-            user.perfil.ubicacion = data['ubicacion']
-            user.perfil.save()
-            print(f"✓ Usuario creado: {user.username}")
-        else:
-            print(f"• Usuario existente: {user.username}")
+        usuarios = User.objects.in_bulk(usernames, field_name='username')
         
-        usuarios_creados.append(user)
+        # bulk_create no dispara post_save, así que los perfiles se crean aquí
+        PerfilUsuario.objects.bulk_create([
+            PerfilUsuario(
+                usuario=usuarios[data['username']],
+                bio=data['bio'],
+                ubicacion=data['ubicacion'],
+            )
+            for data in nuevos_data
+        ], ignore_conflicts=True)
+    
+    if nuevos_data:
+        invalidar_grafo()
+    
+    for username in usernames:
+        if username in existentes:
+            print(f"• Usuario existente: {username}")
+        else:
+            print(f"✓ Usuario creado: {username}")
     
-    return usuarios_creados
+    return [usuarios[username] for username in usernames]
 
 
 def crear_amistades(usuarios):
@@ -85,15 +108,45 @@ def crear_amistades(usuarios):
         ('lucia', 'elena'),
     ]
     
+    por_nombre = {user.username: user for user in usuarios}
+    
+    existentes = set()
+    for usuario1_id, usuario2_id in Amistad.objects.filter(
+        usuario1__in=usuarios, usuario2__in=usuarios
+    ).values_list('usuario1_id', 'usuario2_id'):
+        existentes.add(frozenset((usuario1_id, usuario2_id)))
+    
+    nuevas = []
     for user1_name, user2_name in amistades:
-        user1 = User.objects.get(username=user1_name)
-        user2 = User.objects.get(username=user2_name)
+        user1, user2 = Amistad.ordenar_par(por_nombre[user1_name], por_nombre[user2_name])
         
-        if not Amistad.son_amigos(user1, user2):
-            Amistad.objects.create(usuario1=user1, usuario2=user2)
+        if frozenset((user1.id, user2.id)) not in existentes:
+            nuevas.append(Amistad(usuario1=user1, usuario2=user2))
             print(f"✓ Amistad creada: {user1_name} ↔ {user2_name}")
         else:
             print(f"• Amistad existente: {user1_name} ↔ {user2_name}")
+    
+    with transaction.atomic():
+        Amistad.objects.bulk_create(nuevas, ignore_conflicts=True)
+        
+        # bulk_create no dispara las señales: recalcular el contador de amigos
+        conteos = Counter()
+        for usuario1_id, usuario2_id in Amistad.objects.filter(
+            Q(usuario1__in=usuarios) | Q(usuario2__in=usuarios)
+        ).values_list('usuario1_id', 'usuario2_id'):
+            conteos[usuario1_id] += 1
+            conteos[usuario2_id] += 1
+        
+        perfiles = list(PerfilUsuario.objects.filter(usuario__in=usuarios))
+        for perfil in perfiles:
+            perfil.num_amigos = conteos[perfil.usuario_id]
+        PerfilUsuario.objects.bulk_update(perfiles, ['num_amigos'])
+    
+    # Tampoco se disparan las señales que invalidan el grafo ni las que
+    # encolan el recálculo de los candidatos, así que se recalculan aquí
+    if nuevas:
+        invalidar_grafo()
+        MotorRecomendaciones().materializar_candidatos(user.id for user in usuarios)
 
 
 def demostrar_grafo():
@@ -123,12 +176,13 @@ def demostrar_grafo():
     recomendaciones = motor.obtener_recomendaciones(sofia, limite=5)
     
     for i, rec in enumerate(recomendaciones, 1):
-        print(f"\n   {i}. {rec['usuario'].first_name} {rec['usuario'].last_name}")
-        print(f"      • Puntuación: {rec['puntuacion']}")
-        print(f"      • Amigos en común: {rec['num_amigos_comun']}")
-        print(f"      • Distancia: {rec['distancia']} pasos")
-        if rec['amigos_comun_nombres']:
-            print(f"      • Conexiones: {', '.join(rec['amigos_comun_nombres'])}")
+        print(f"\n   {i}. {rec.usuario.first_name} {rec.usuario.last_name}")
+        print(f"      • Puntuación: {rec.puntuacion}")
+        print(f"      • Amigos en común: {rec.num_amigos_comun}")
+        if rec.distancia > 0:
+            print(f"      • Distancia: {rec.distancia} pasos")
+        if rec.amigos_comun_nombres:
+            print(f"      • Conexiones: {', '.join(rec.amigos_comun_nombres)}")
     
     print("\n" + "="*60)
 
@@ -83,6 +83,30 @@ DATABASES = {
 }
 
 
+# Caché
+# Las versiones del grafo, perfiles y solicitudes viven en la caché, así que
+# debe ser compartida por todos los procesos (servidor, workers y comandos).
+# Con REDIS_URL se usa Redis; en desarrollo, archivos en BASE_DIR / 'cache'.
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': BASE_DIR / 'cache',
+            'OPTIONS': {
+                'MAX_ENTRIES': 10000,
+            },
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -127,6 +151,10 @@ MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
 # Autenticación
+AUTHENTICATION_BACKENDS = [
+    # Igual que ModelBackend, pero carga request.user con su perfil
+    'usuarios.backends.UsuarioConPerfilBackend',
+]
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'
 LOGOUT_REDIRECT_URL = 'inicio'
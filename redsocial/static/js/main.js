@@ -56,4 +56,91 @@ document.addEventListener('DOMContentLoaded', function () {
     scoreBadges.forEach(badge => {
         badge.title = 'Puntuación basada en amigos en común y cercanía en el grafo social';
     });
+
+    // Carga incremental de recomendaciones al llegar al final de la lista
+    const masRecomendaciones = document.getElementById('mas-recomendaciones');
+    const plantilla = document.getElementById('plantilla-recomendacion');
+    if (masRecomendaciones && plantilla && 'IntersectionObserver' in window) {
+        const grid = masRecomendaciones.parentElement.querySelector('.users-grid');
+        let desde = masRecomendaciones.dataset.desde;
+        let cargando = false;
+
+        const crearTarjeta = rec => {
+            const tarjeta = plantilla.content.firstElementChild.cloneNode(true);
+            const campo = nombre => tarjeta.querySelector(`[data-campo="${nombre}"]`);
+
+            if (rec.foto) {
+                campo('foto').src = rec.foto;
+                campo('sin-foto').remove();
+            } else {
+                campo('foto').remove();
+            }
+            campo('nombre').textContent = rec.nombre;
+            campo('username').textContent = '@' + rec.username;
+
+            if (rec.puntuacion > 0) {
+                campo('puntuacion').querySelector('span').textContent = rec.puntuacion;
+                campo('puntuacion').title = 'Puntuación basada en amigos en común y cercanía en el grafo social';
+            } else {
+                campo('puntuacion').remove();
+            }
+
+            if (rec.num_amigos_comun > 0) {
+                const plural = rec.num_amigos_comun === 1 ? '' : 's';
+                campo('amigos-comun').querySelector('span').textContent =
+                    `${rec.num_amigos_comun} amigo${plural} en común`;
+                if (rec.amigos_comun_nombres.length) {
+                    campo('amigos-comun').querySelector('small').textContent =
+                        `(${rec.amigos_comun_nombres.join(', ')})`;
+                } else {
+                    campo('amigos-comun').querySelector('br').remove();
+                }
+            } else {
+                campo('amigos-comun').remove();
+            }
+
+            if (rec.distancia > 0) {
+                const plural = rec.distancia === 1 ? '' : 's';
+                campo('distancia').querySelector('span span').textContent =
+                    `A ${rec.distancia} paso${plural} de ti`;
+            } else {
+                campo('distancia').remove();
+            }
+
+            campo('url-perfil').href = rec.url_perfil;
+            campo('url-enviar').href = rec.url_enviar;
+            return tarjeta;
+        };
+
+        const observador = new IntersectionObserver(entradas => {
+            if (!entradas.some(entrada => entrada.isIntersecting) || cargando) {
+                return;
+            }
+            cargando = true;
+            fetch(`${masRecomendaciones.dataset.url}?desde=${desde}`, { credentials: 'same-origin' })
+                .then(respuesta => respuesta.json())
+                .then(datos => {
+                    datos.items.forEach(rec => grid.appendChild(crearTarjeta(rec)));
+                    if (datos.siguiente === null) {
+                        observador.disconnect();
+                        masRecomendaciones.remove();
+                    } else {
+                        desde = datos.siguiente;
+                        // Volver a observar para seguir cargando si el aviso sigue visible
+                        observador.unobserve(masRecomendaciones);
+                        observador.observe(masRecomendaciones);
+                    }
+                })
+                .catch(() => {
+                    observador.disconnect();
+                    masRecomendaciones.remove();
+                })
+                .finally(() => {
+                    cargando = false;
+                });
+        });
+        observador.observe(masRecomendaciones);
+    } else if (masRecomendaciones) {
+        masRecomendaciones.remove();
+    }
 });
@@ -4,7 +4,7 @@ from .models import PerfilUsuario, SolicitudAmistad, Amistad
 
 @admin.register(PerfilUsuario)
 class PerfilUsuarioAdmin(admin.ModelAdmin):
-    list_display = ('usuario', 'ubicacion', 'fecha_creacion')
+    list_display = ('usuario', 'ubicacion', 'num_amigos', 'fecha_creacion')
     search_fields = ('usuario__username', 'usuario__email', 'ubicacion')
     list_filter = ('fecha_creacion',)
 
@@ -0,0 +1,29 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+
+
+UserModel = get_user_model()
+
+
+class UsuarioConPerfilBackend(ModelBackend):
+    """
+    Backend de autenticación que carga el perfil junto con el usuario.
+    
+    Casi todas las vistas (y la plantilla base) usan request.user.perfil;
+    al traerlo con select_related en la misma consulta de la sesión se
+    evita una consulta extra en cada petición autenticada.
+    """
+    
+    def get_user(self, user_id):
+        try:
+            user = UserModel._default_manager.select_related('perfil').get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+    
+    async def aget_user(self, user_id):
+        try:
+            user = await UserModel._default_manager.select_related('perfil').aget(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
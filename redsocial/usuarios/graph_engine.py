@@ -8,9 +8,149 @@ Este módulo implementa algoritmos de grafos para:
 4. Generar recomendaciones inteligentes basadas en puntuación
 """
 
-from collections import deque, defaultdict
+import heapq
+import time
+from array import array
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from itertools import chain
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
 from django.db.models import Q
+from django.utils import timezone
+
+
+CLAVE_VERSION_GRAFO = 'graph_version'
+CLAVE_VERSION_PERFILES = 'perfil_version'
+CLAVE_VERSION_SOLICITUDES = 'sol_version:{usuario_id}'
+CLAVE_VERSION_CANDIDATOS = 'recs_version:{usuario_id}'
+TIEMPO_CACHE_BFS = 3600  # segundos
+TIEMPO_CACHE_DASHBOARD = 300  # segundos
+TIEMPO_CACHE_ESTADISTICAS = 3600  # segundos
+TIEMPO_CACHE_RECOMENDACIONES = 3600  # segundos
+
+# Tipo de los arreglos de vecinos: enteros de 64 bits (BigAutoField)
+TIPO_IDS = 'q'
+
+# Vecindario vacío compartido, evita crear uno nuevo en cada consulta
+_SIN_AMIGOS = ()
+
+# Grafo construido compartido por todas las peticiones del proceso:
+# {'version': int, 'grafo': {usuario_id: array(amigos_ids ordenados)}}
+_graph_cache = {}
+
+# Motor compartido por las vistas (ver obtener_motor)
+_motor = None
+
+
+def obtener_version(clave):
+    """
+    Retorna el valor actual de una versión de caché.
+    
+    Las versiones viven en la caché de Django configurada en settings
+    (CACHES), que es compartida por todos los procesos, así que una
+    invalidación hecha por un proceso la ven todos los demás.
+    """
+    version = cache.get(clave)
+    if version is None:
+        cache.add(clave, time.time_ns(), timeout=None)
+        version = cache.get(clave)
+    return version
+
+
+def obtener_versiones(*claves):
+    """
+    Igual que obtener_version para varias claves, leídas de la caché
+    compartida en una sola consulta.
+    
+    Returns:
+        list: Versiones en el mismo orden que las claves
+    """
+    versiones = cache.get_many(claves)
+    return [
+        versiones[clave] if clave in versiones else obtener_version(clave)
+        for clave in claves
+    ]
+
+
+def incrementar_version(clave):
+    """
+    Cambia una versión de caché (ver obtener_version).
+    
+    En lugar de incr, que en los backends de archivos o base de datos es
+    leer y escribir sin bloqueo, se escribe un timestamp nuevo: dos procesos
+    que invalidan a la vez nunca dejan una versión que ya se había leído.
+    """
+    cache.set(clave, time.time_ns(), timeout=None)
+
+
+def incrementar_versiones(*claves):
+    """Igual que incrementar_version para varias claves, en una sola escritura."""
+    version = time.time_ns()
+    cache.set_many({clave: version for clave in claves}, timeout=None)
+
+
+def obtener_version_grafo():
+    """Retorna la versión actual del grafo social."""
+    return obtener_version(CLAVE_VERSION_GRAFO)
+
+
+def invalidar_grafo():
+    """Cambia la versión del grafo para descartar el grafo en caché."""
+    incrementar_version(CLAVE_VERSION_GRAFO)
+
+
+def clave_dashboard(usuario_id, version=None):
+    """
+    Clave de caché del contexto del dashboard de un usuario.
+    
+    Incluye la versión del grafo, así que cualquier cambio de amistades
+    descarta los dashboards anteriores sin borrarlos uno por uno.
+    """
+    if version is None:
+        version = obtener_version_grafo()
+    return f'dashboard:{usuario_id}:{version}'
+
+
+def invalidar_dashboard(*usuario_ids):
+    """Descarta el dashboard en caché de los usuarios indicados."""
+    version = obtener_version_grafo()
+    cache.delete_many([clave_dashboard(usuario_id, version) for usuario_id in usuario_ids])
+
+
+def _interseccion_ordenada(amigos1, amigos2):
+    """Intersección de dos secuencias ordenadas con dos punteros."""
+    comunes = []
+    i = j = 0
+    total1, total2 = len(amigos1), len(amigos2)
+    while i < total1 and j < total2:
+        amigo1, amigo2 = amigos1[i], amigos2[j]
+        if amigo1 == amigo2:
+            comunes.append(amigo1)
+            i += 1
+            j += 1
+        elif amigo1 < amigo2:
+            i += 1
+        else:
+            j += 1
+    return tuple(comunes)
+
+
+@lru_cache(maxsize=8192)
+def _amigos_en_comun_memo(usuario1_id, usuario2_id, version):
+    """
+    Amigos en común memorizados por (par ordenado, versión del grafo).
+    
+    La versión forma parte de la clave, así que una invalidación del grafo
+    hace que las entradas anteriores simplemente dejen de consultarse.
+    """
+    grafo = _graph_cache['grafo']
+    return _interseccion_ordenada(
+        grafo.get(usuario1_id, _SIN_AMIGOS),
+        grafo.get(usuario2_id, _SIN_AMIGOS),
+    )
 
 
 class GrafoSocial:
@@ -22,42 +162,84 @@ class GrafoSocial:
     """
     
     def __init__(self):
-        # Diccionario de adyacencia: {usuario_id: set(amigos_ids)}
-        self.grafo = defaultdict(set)
+        # Diccionario de adyacencia: {usuario_id: array(amigos_ids ordenados)}
+        self.grafo = {}
         self._construido = False
+        self._version = None
     
     def construir_grafo(self):
         """
         Construye el grafo social a partir de la base de datos.
         Cada usuario es un nodo y cada amistad es una arista.
-        """
-        from .models import Amistad
-        
-        self.grafo.clear()
         
-        # Agregar todos los usuarios como nodos
-        for user in User.objects.all():
-            self.grafo[user.id]  # Asegura que el nodo existe
+        El grafo se reutiliza entre peticiones mientras la versión del
+        grafo no cambie (las señales de Amistad la incrementan).
+        """
+        version = obtener_version_grafo()
+        if self._construido and self._version == version:
+            return self
         
-        # Agregar las aristas (amistades)
-        for amistad in Amistad.objects.all():
-            self.grafo[amistad.usuario1_id].add(amistad.usuario2_id)
-            self.grafo[amistad.usuario2_id].add(amistad.usuario1_id)
+        if _graph_cache.get('version') != version:
+            _graph_cache['grafo'] = self._cargar_grafo()
+            _graph_cache['version'] = version
         
+        self.grafo = _graph_cache['grafo']
+        self._version = version
         self._construido = True
         return self
     
+    def _cargar_grafo(self):
+        """
+        Lee usuarios y amistades de la base de datos.
+        
+        Los vecinos de cada nodo se guardan como un array ordenado de
+        enteros (8 bytes por arista) en lugar de un set, que tiene un costo
+        fijo alto por instancia. El grafo es de solo lectura una vez
+        construido, así que no se necesita inserción rápida.
+        """
+        from .models import Amistad
+        
+        # Agregar todos los usuarios como nodos (solo se necesita el id)
+        vecinos = defaultdict(list)
+        vecinos.update(
+            (usuario_id, [])
+            for usuario_id in User.objects.values_list('id', flat=True)
+        )
+        
+        # Agregar las aristas (amistades) leyendo solo los pares de ids;
+        # cada par es único (par ordenado + unique_together), no hay duplicados
+        aristas = Amistad.objects.values_list('usuario1_id', 'usuario2_id')
+        for usuario1_id, usuario2_id in aristas.iterator(chunk_size=5000):
+            vecinos[usuario1_id].append(usuario2_id)
+            vecinos[usuario2_id].append(usuario1_id)
+        
+        return {
+            usuario_id: array(TIPO_IDS, sorted(amigos))
+            for usuario_id, amigos in vecinos.items()
+        }
+    
     def obtener_amigos(self, usuario_id):
-        """Retorna los IDs de los amigos directos de un usuario."""
+        """
+        Retorna los IDs de los amigos directos de un usuario como secuencia
+        ordenada de solo lectura (envolver en set() si se necesita pertenencia).
+        """
         if not self._construido:
             self.construir_grafo()
-        return self.grafo.get(usuario_id, set())
+        return self.grafo.get(usuario_id, _SIN_AMIGOS)
     
     def bfs_niveles(self, usuario_id, nivel_maximo=2):
         """
         Implementación de BFS (Breadth-First Search) para encontrar
         usuarios a N niveles de distancia.
         
+        El BFS avanza nivel por nivel: la frontera siguiente es la unión de
+        los vecinos de la frontera actual menos los ya visitados. Cada nivel
+        se resuelve con operaciones de conjuntos (implementadas en C) en
+        lugar de procesar nodo por nodo desde una cola.
+        
+        El resultado se guarda en caché por (usuario, versión del grafo,
+        nivel máximo), así que se reutiliza hasta que cambie una amistad.
+        
         Args:
             usuario_id: ID del usuario origen
             nivel_maximo: Profundidad máxima de búsqueda
@@ -68,42 +250,144 @@ class GrafoSocial:
         if not self._construido:
             self.construir_grafo()
         
-        visitados = {usuario_id}
-        cola = deque([(usuario_id, 0)])
+        if self._version is None:
+            return self._calcular_bfs_niveles(usuario_id, nivel_maximo)
+        
+        clave = f'bfs:{usuario_id}:{self._version}:{nivel_maximo}'
+        guardado = cache.get(clave)
+        if guardado is None:
+            niveles = self._calcular_bfs_niveles(usuario_id, nivel_maximo)
+            cache.set(
+                clave,
+                {nivel: list(usuarios) for nivel, usuarios in niveles.items()},
+                TIEMPO_CACHE_BFS
+            )
+            return niveles
+        
         niveles = defaultdict(set)
+        for nivel, usuarios in guardado.items():
+            niveles[nivel] = set(usuarios)
+        return niveles
+    
+    def _calcular_bfs_niveles(self, usuario_id, nivel_maximo):
+        """Ejecuta el BFS por niveles sin consultar la caché."""
+        niveles = defaultdict(set)
+        if nivel_maximo < 1:
+            return niveles
         
-        while cola:
-            actual, nivel = cola.popleft()
-            
-            if nivel >= nivel_maximo:
-                continue
+        # Todo nodo alcanzado es clave del grafo: sus vecinos se leen con el
+        # __getitem__ del diccionario (C) en vez de un método Python por nodo
+        vecinos_de = self.grafo.__getitem__
+        visitados = {usuario_id}
+        siguiente = set(self.grafo.get(usuario_id, _SIN_AMIGOS))
+        siguiente -= visitados
+        nivel = 1
+        
+        while siguiente:
+            niveles[nivel] = siguiente
+            if nivel == nivel_maximo:
+                break
             
-            for vecino in self.grafo.get(actual, set()):
-                if vecino not in visitados:
-                    visitados.add(vecino)
-                    niveles[nivel + 1].add(vecino)
-                    cola.append((vecino, nivel + 1))
+            visitados |= siguiente
+            siguiente = set().union(*map(vecinos_de, siguiente))
+            siguiente -= visitados
+            nivel += 1
         
         return niveles
     
+    @staticmethod
+    def distancias_desde_niveles(niveles):
+        """
+        Invierte el resultado de bfs_niveles para consultar distancias en O(1).
+        
+        Returns:
+            dict: {usuario_id: distancia}
+        """
+        return {
+            usuario_id: nivel
+            for nivel, usuarios in niveles.items()
+            for usuario_id in usuarios
+        }
+    
     def amigos_en_comun(self, usuario1_id, usuario2_id):
         """
         Calcula los amigos en común entre dos usuarios.
         
+        Como los vecinos están ordenados, la intersección es un recorrido
+        con dos punteros en O(d1 + d2). El resultado se memoriza por par y
+        versión del grafo, ya que los mismos pares se repiten entre vistas.
+        
         Returns:
-            set: Conjunto de IDs de amigos en común
+            tuple: IDs de amigos en común, ordenados
         """
         if not self._construido:
             self.construir_grafo()
         
-        amigos1 = self.grafo.get(usuario1_id, set())
-        amigos2 = self.grafo.get(usuario2_id, set())
+        if usuario1_id > usuario2_id:
+            usuario1_id, usuario2_id = usuario2_id, usuario1_id
         
-        return amigos1.intersection(amigos2)
+        # La memoria solo es válida si este grafo es el compartido actual
+        if _graph_cache.get('grafo') is self.grafo:
+            return _amigos_en_comun_memo(usuario1_id, usuario2_id, self._version)
+        return _interseccion_ordenada(
+            self.grafo.get(usuario1_id, _SIN_AMIGOS),
+            self.grafo.get(usuario2_id, _SIN_AMIGOS),
+        )
+    
+    def amigos_en_comun_con_todos(self, usuario_id):
+        """
+        Calcula en una sola pasada los amigos en común entre un usuario y
+        todos los usuarios a distancia 2 (o amigos directos con amigos
+        compartidos).
+        
+        Recorre los amigos de los amigos una sola vez, en lugar de
+        intersectar conjuntos candidato por candidato.
+        
+        Returns:
+            dict: {usuario_id: list(amigos_en_comun_ids)}
+        """
+        if not self._construido:
+            self.construir_grafo()
+        
+        comunes = defaultdict(list)
+        vecinos_de = self.grafo.__getitem__
+        for amigo_id in self.grafo.get(usuario_id, _SIN_AMIGOS):
+            for otro_id in vecinos_de(amigo_id):
+                comunes[otro_id].append(amigo_id)
+        
+        # El propio usuario aparece una vez por amigo; se descarta al final
+        # para no comparar en cada arista
+        comunes.pop(usuario_id, None)
+        return comunes
+    
+    def contar_amigos_en_comun_con_todos(self, usuario_id):
+        """
+        Igual que amigos_en_comun_con_todos pero solo cuenta los amigos en
+        común, sin guardar quiénes son.
+        
+        El conteo lo hace Counter sobre los arrays de vecinos encadenados,
+        así el bucle por arista corre en C y no en bytecode de Python.
+        
+        Returns:
+            Counter: {usuario_id: num_amigos_en_comun}
+        """
+        if not self._construido:
+            self.construir_grafo()
+        
+        vecinos_de = self.grafo.__getitem__
+        conteos = Counter(chain.from_iterable(
+            map(vecinos_de, self.grafo.get(usuario_id, _SIN_AMIGOS))
+        ))
+        del conteos[usuario_id]
+        return conteos
     
     def distancia_entre_usuarios(self, origen_id, destino_id, max_distancia=5):
         """
-        Calcula la distancia mínima entre dos usuarios usando BFS.
+        Calcula la distancia mínima entre dos usuarios usando BFS bidireccional.
+        
+        Se expande por niveles alternando desde el origen y desde el destino
+        (siempre la frontera más pequeña) hasta que ambas búsquedas se tocan,
+        lo que visita muchos menos nodos que un BFS de un solo lado.
         
         Returns:
             int: Distancia en el grafo, -1 si no hay conexión
@@ -114,26 +398,58 @@ class GrafoSocial:
         if origen_id == destino_id:
             return 0
         
-        visitados = {origen_id}
-        cola = deque([(origen_id, 0)])
-        
-        while cola:
-            actual, distancia = cola.popleft()
+        # {usuario_id: distancia desde su lado de la búsqueda}
+        desde_origen = {origen_id: 0}
+        desde_destino = {destino_id: 0}
+        frontera_origen = [origen_id]
+        frontera_destino = [destino_id]
+        profundidad = 0
+        vecinos_de = self.grafo.get
+        
+        while frontera_origen and frontera_destino and profundidad < max_distancia:
+            expandir_origen = len(frontera_origen) <= len(frontera_destino)
+            if expandir_origen:
+                frontera, visitados, otros = frontera_origen, desde_origen, desde_destino
+            else:
+                frontera, visitados, otros = frontera_destino, desde_destino, desde_origen
+            
+            mejor = -1
+            siguiente = []
+            agregar = siguiente.append
+            for actual in frontera:
+                distancia = visitados[actual] + 1
+                for vecino in vecinos_de(actual, _SIN_AMIGOS):
+                    if vecino in otros:
+                        total = distancia + otros[vecino]
+                        if mejor == -1 or total < mejor:
+                            mejor = total
+                    elif vecino not in visitados:
+                        visitados[vecino] = distancia
+                        agregar(vecino)
             
-            if distancia >= max_distancia:
-                continue
+            # El nivel se completa antes de responder para obtener el mínimo
+            if mejor != -1:
+                return mejor
             
-            for vecino in self.grafo.get(actual, set()):
-                if vecino == destino_id:
-                    return distancia + 1
-                
-                if vecino not in visitados:
-                    visitados.add(vecino)
-                    cola.append((vecino, distancia + 1))
+            if expandir_origen:
+                frontera_origen = siguiente
+            else:
+                frontera_destino = siguiente
+            profundidad += 1
         
         return -1  # No hay conexión
 
 
+@dataclass(slots=True)
+class Recomendacion:
+    """Un usuario recomendado junto con los datos de su puntuación."""
+    usuario: User
+    puntuacion: int
+    num_amigos_comun: int
+    amigos_comun_nombres: list = field(default_factory=list)
+    distancia: int = -1
+
+
 class MotorRecomendaciones:
     """
     Motor de recomendaciones inteligentes basado en análisis de grafos.
@@ -141,43 +457,50 @@ class MotorRecomendaciones:
     Fórmula de puntuación:
     - Amigos en común: +10 puntos por cada uno
     - Distancia en grafo: +5 puntos si nivel 2, +2 si nivel 3
-    - Usuarios sin conexión: 0 puntos
+    - Usuarios a más de 3 pasos o sin conexión: 0 puntos
     """
     
+    PUNTOS_AMIGO_COMUN = 10
+    PUNTOS_POR_DISTANCIA = {2: 5, 3: 2}
+    TAMANO_LOTE = 500
+    TOPE_RECOMENDACIONES_CACHE = 50
+    
     def __init__(self):
         self.grafo = GrafoSocial()
     
-    def calcular_puntuacion(self, usuario_id, candidato_id):
+    def calcular_puntuacion(self, usuario_id, candidato_id, distancias=None, comunes=None):
         """
         Calcula la puntuación de recomendación para un candidato.
         
         Args:
             usuario_id: ID del usuario para quien buscamos recomendaciones
             candidato_id: ID del usuario candidato a recomendar
+            distancias: {usuario_id: distancia} precalculado desde usuario_id;
+                si se omite se ejecuta un BFS para este candidato
+            comunes: resultado de amigos_en_comun_con_todos(usuario_id);
+                si se omite se intersectan los amigos de ambos usuarios
             
         Returns:
             dict: {puntuacion, amigos_comun, distancia}
         """
         # Amigos en común
-        amigos_comun = self.grafo.amigos_en_comun(usuario_id, candidato_id)
+        if comunes is not None:
+            amigos_comun = comunes.get(candidato_id, [])
+        else:
+            amigos_comun = self.grafo.amigos_en_comun(usuario_id, candidato_id)
         num_amigos_comun = len(amigos_comun)
         
         # Distancia en el grafo
-        distancia = self.grafo.distancia_entre_usuarios(usuario_id, candidato_id)
-        
-        # Calcular puntuación
-        puntuacion = 0
-        
-        # +10 por cada amigo en común
-        puntuacion += num_amigos_comun * 10
-        
-        # Puntos por cercanía en el grafo
-        if distancia == 2:
-            puntuacion += 5
-        elif distancia == 3:
-            puntuacion += 2
-        elif distancia > 3:
-            puntuacion += 1
+        if distancias is not None:
+            distancia = distancias.get(candidato_id, -1)
+        else:
+            distancia = self.grafo.distancia_entre_usuarios(usuario_id, candidato_id)
+        
+        # Calcular puntuación: amigos en común + cercanía en el grafo
+        puntuacion = (
+            num_amigos_comun * self.PUNTOS_AMIGO_COMUN
+            + self.PUNTOS_POR_DISTANCIA.get(distancia, 0)
+        )
         
         return {
             'puntuacion': puntuacion,
@@ -186,112 +509,372 @@ class MotorRecomendaciones:
             'distancia': distancia
         }
     
-    def obtener_recomendaciones(self, usuario, limite=10):
+    def calcular_candidatos(self, usuario_id):
+        """
+        Calcula todos los candidatos de un usuario (distancia 2 a 4) con su
+        puntuación, usando un solo BFS y una sola pasada de amigos en común.
+        
+        Returns:
+            list: Tuplas (candidato_id, puntuacion, num_amigos_comun, distancia)
+        """
+        self.grafo.construir_grafo()
+        
+        niveles = self.grafo.bfs_niveles(usuario_id, nivel_maximo=4)
+        comunes = self.grafo.contar_amigos_en_comun_con_todos(usuario_id)
+        
+        candidatos = []
+        for nivel in [2, 3, 4]:
+            puntos_nivel = self.PUNTOS_POR_DISTANCIA.get(nivel, 0)
+            for candidato_id in niveles.get(nivel, set()):
+                num_amigos_comun = comunes[candidato_id]
+                candidatos.append((
+                    candidato_id,
+                    num_amigos_comun * self.PUNTOS_AMIGO_COMUN + puntos_nivel,
+                    num_amigos_comun,
+                    nivel,
+                ))
+        return candidatos
+    
+    def materializar_candidatos(self, usuario_ids):
+        """
+        Recalcula y guarda en RecomendacionCandidato los candidatos de los
+        usuarios indicados, reemplazando las filas anteriores.
+        
+        Solo se guardan los TOPE_RECOMENDACIONES_CACHE mejores de cada
+        usuario, que son los únicos que se llegan a mostrar. Los usuarios por
+        distancia se cuentan con todos los candidatos y quedan en la
+        instantánea de estadísticas en caché. También se descartan las
+        recomendaciones y dashboards en caché de esos usuarios.
+        """
+        from .models import PerfilUsuario, RecomendacionCandidato
+        
+        self.grafo.construir_grafo()
+        usuario_ids = list(usuario_ids)
+        for inicio in range(0, len(usuario_ids), self.TAMANO_LOTE):
+            lote = usuario_ids[inicio:inicio + self.TAMANO_LOTE]
+            filas = []
+            estadisticas = {}
+            for usuario_id in lote:
+                candidatos = self.calcular_candidatos(usuario_id)
+                # Mismo orden que la lectura: puntuación desc., id asc.
+                mejores = heapq.nlargest(
+                    self.TOPE_RECOMENDACIONES_CACHE, candidatos,
+                    key=lambda candidato: (candidato[1], -candidato[0])
+                )
+                filas.extend(
+                    RecomendacionCandidato(
+                        usuario_id=usuario_id,
+                        candidato_id=candidato_id,
+                        puntuacion=puntuacion,
+                        num_amigos_comun=num_amigos_comun,
+                        distancia=distancia,
+                    )
+                    for candidato_id, puntuacion, num_amigos_comun, distancia in mejores
+                )
+                estadisticas[self._clave_estadisticas(usuario_id)] = self._armar_estadisticas(
+                    usuario_id, Counter(candidato[3] for candidato in candidatos)
+                )
+            with transaction.atomic():
+                RecomendacionCandidato.objects.filter(usuario_id__in=lote).delete()
+                RecomendacionCandidato.objects.bulk_create(filas, batch_size=self.TAMANO_LOTE)
+                # La marca distingue "sin candidatos" de "nunca materializado"
+                PerfilUsuario.objects.filter(usuario_id__in=lote).update(
+                    candidatos_actualizados=timezone.now()
+                )
+            cache.set_many(estadisticas, TIEMPO_CACHE_ESTADISTICAS)
+            # Recomendaciones y dashboards cacheados con los candidatos
+            # anteriores, y ETag de las páginas que los muestran
+            cache.delete_many([self._clave_recomendaciones(usuario_id) for usuario_id in lote])
+            invalidar_dashboard(*lote)
+            incrementar_versiones(*(
+                CLAVE_VERSION_CANDIDATOS.format(usuario_id=usuario_id) for usuario_id in lote
+            ))
+    
+    def procesar_recalculos_pendientes(self):
+        """
+        Recalcula los candidatos afectados por las amistades creadas o
+        eliminadas desde la última ejecución (cola RecalculoPendiente).
+        
+        Una arista (a, b) solo cambia distancias de hasta 4 pasos y amigos en
+        común para usuarios a 3 pasos o menos de a o de b, así que basta con
+        recalcular ese vecindario y no todo el grafo. También se materializan
+        los usuarios que nunca lo fueron (por ejemplo, recién registrados).
+        Lo ejecuta el comando actualizar_recomendaciones, fuera de las
+        peticiones.
+        
+        Returns:
+            set: IDs de los usuarios recalculados
+        """
+        from .models import PerfilUsuario, RecalculoPendiente
+        
+        # La cola se lee antes de construir el grafo, así el grafo ya
+        # incluye todas las amistades que generaron esas entradas
+        pendientes = list(RecalculoPendiente.objects.values_list('id', 'usuario_id'))
+        afectados = set(
+            PerfilUsuario.objects.filter(candidatos_actualizados__isnull=True)
+            .values_list('usuario_id', flat=True)
+        )
+        if not pendientes and not afectados:
+            return set()
+        self.grafo.construir_grafo()
+        
+        for origen_id in {usuario_id for _, usuario_id in pendientes}:
+            afectados.add(origen_id)
+            for usuarios in self.grafo.bfs_niveles(origen_id, nivel_maximo=3).values():
+                afectados.update(usuarios)
+        
+        self.materializar_candidatos(afectados)
+        
+        # Solo se borran las entradas leídas; las que llegaron mientras
+        # tanto quedan para la siguiente ejecución
+        ids = [pendiente_id for pendiente_id, _ in pendientes]
+        for inicio in range(0, len(ids), self.TAMANO_LOTE):
+            RecalculoPendiente.objects.filter(id__in=ids[inicio:inicio + self.TAMANO_LOTE]).delete()
+        return afectados
+    
+    def _candidatos_vigentes(self, usuario):
+        """
+        Indica si las filas guardadas del usuario reflejan el grafo actual.
+        
+        No lo hacen si nunca se materializó o si hay una amistad pendiente de
+        procesar a 3 pasos o menos (el mismo vecindario que recalcula
+        procesar_recalculos_pendientes).
+        """
+        from .models import RecalculoPendiente
+        
+        if usuario.perfil.candidatos_actualizados is None:
+            return False
+        
+        pendientes = set(
+            RecalculoPendiente.objects.values_list('usuario_id', flat=True).distinct()
+        )
+        if not pendientes:
+            return True
+        if usuario.id in pendientes:
+            return False
+        niveles = self.grafo.bfs_niveles(usuario.id, nivel_maximo=3)
+        return all(pendientes.isdisjoint(usuarios) for usuarios in niveles.values())
+    
+    def obtener_recomendaciones(self, usuario, limite=10, desplazamiento=0):
         """
         Obtiene las mejores recomendaciones de amigos para un usuario.
         
-        El algoritmo:
-        1. Construye el grafo social actualizado
-        2. Usa BFS para encontrar usuarios a 2-3 niveles de distancia
-        3. Calcula puntuación para cada candidato
-        4. Ordena por puntuación y retorna los mejores
+        Las primeras TOPE_RECOMENDACIONES_CACHE se calculan una vez y se
+        guardan en caché (solo IDs y puntuaciones) por usuario, versión del
+        grafo y versión de sus solicitudes; cada llamada solo recarga los
+        usuarios de la página pedida.
         
         Args:
             usuario: Objeto User de Django
             limite: Número máximo de recomendaciones
+            desplazamiento: Recomendaciones a saltar (para paginar)
             
         Returns:
-            list: Lista de dicts con {usuario, puntuacion, amigos_comun, distancia}
+            list: Lista de Recomendacion ordenada por puntuación
         """
-        from .models import SolicitudAmistad
-        
-        # Reconstruir el grafo para tener datos actualizados
         self.grafo.construir_grafo()
         
-        usuario_id = usuario.id
+        fin = desplazamiento + limite
+        if fin > self.TOPE_RECOMENDACIONES_CACHE:
+            return self._calcular_recomendaciones(usuario, limite, desplazamiento)
+        
+        clave = self._clave_recomendaciones(usuario.id)
+        datos = cache.get(clave)
+        if datos is None:
+            datos = [
+                (rec.usuario.id, rec.puntuacion, rec.num_amigos_comun,
+                 rec.amigos_comun_nombres, rec.distancia)
+                for rec in self._calcular_recomendaciones(usuario, self.TOPE_RECOMENDACIONES_CACHE)
+            ]
+            cache.set(clave, datos, TIEMPO_CACHE_RECOMENDACIONES)
+        
+        pagina = datos[desplazamiento:fin]
+        usuarios = User.objects.select_related('perfil').in_bulk([dato[0] for dato in pagina])
+        return [
+            Recomendacion(usuarios[usuario_id], puntuacion, num_comun, nombres, distancia)
+            for usuario_id, puntuacion, num_comun, nombres, distancia in pagina
+            if usuario_id in usuarios
+        ]
+    
+    def _clave_recomendaciones(self, usuario_id):
+        """Clave de caché de las recomendaciones de un usuario."""
+        version_solicitudes = obtener_version(
+            CLAVE_VERSION_SOLICITUDES.format(usuario_id=usuario_id)
+        )
+        return f'recs:{usuario_id}:{self.grafo._version}:{version_solicitudes}'
+    
+    def _calcular_recomendaciones(self, usuario, limite, desplazamiento=0):
+        """
+        Calcula las recomendaciones de un usuario sin pasar por la caché.
         
-        # Obtener amigos directos (nivel 1) - estos NO son candidatos
-        amigos_directos = self.grafo.obtener_amigos(usuario_id)
+        El algoritmo:
+        1. Lee los candidatos precalculados (distancia 2-4, ya puntuados)
+           ordenados por puntuación directamente en la base de datos; si no
+           están al día (ver _candidatos_vigentes), los calcula en memoria
+           sin guardarlos
+        2. Excluye amigos y usuarios con solicitudes pendientes
+        3. Si no alcanzan, completa con el resto de usuarios, primero los
+           que tienen más amigos (orden estable para poder paginar)
+        
+        Los candidatos se guardan fuera de las peticiones (ver
+        procesar_recalculos_pendientes); los amigos directos se excluyen de
+        todos modos por si las filas tienen a quien ya es amigo.
+        """
+        from .models import SolicitudAmistad, RecomendacionCandidato
         
-        # Obtener usuarios a nivel 2 y 3 usando BFS
-        niveles = self.grafo.bfs_niveles(usuario_id, nivel_maximo=4)
+        # Asegurar que el grafo corresponde a la versión actual
+        self.grafo.construir_grafo()
         
-        # Candidatos son usuarios en nivel 2, 3 y 4
-        candidatos_ids = set()
-        for nivel in [2, 3, 4]:
-            candidatos_ids.update(niveles.get(nivel, set()))
-        
-        # Si hay pocos candidatos por conexiones, agregar usuarios sin conexión
-        if len(candidatos_ids) < limite:
-            todos_usuarios = set(User.objects.values_list('id', flat=True))
-            sin_conexion = todos_usuarios - amigos_directos - {usuario_id} - candidatos_ids
-            candidatos_ids.update(sin_conexion)
-        
-        # Excluir usuarios con solicitudes pendientes
-        solicitudes_enviadas = set(
-            SolicitudAmistad.objects.filter(
-                de_usuario=usuario, 
-                estado='pendiente'
-            ).values_list('para_usuario_id', flat=True)
-        )
-        solicitudes_recibidas = set(
-            SolicitudAmistad.objects.filter(
-                para_usuario=usuario,
-                estado='pendiente'
-            ).values_list('de_usuario_id', flat=True)
-        )
+        usuario_id = usuario.id
         
-        candidatos_ids -= solicitudes_enviadas
-        candidatos_ids -= solicitudes_recibidas
-        
-        # Calcular puntuación para cada candidato
-        recomendaciones = []
-        for candidato_id in candidatos_ids:
-            try:
-                candidato_user = User.objects.get(id=candidato_id)
-                datos = self.calcular_puntuacion(usuario_id, candidato_id)
-                
-                # Obtener nombres de amigos en común
-                amigos_comun_nombres = []
-                for amigo_id in datos['amigos_comun'][:3]:  # Máximo 3 para mostrar
-                    try:
-                        amigo = User.objects.get(id=amigo_id)
-                        amigos_comun_nombres.append(amigo.username)
-                    except User.DoesNotExist:
-                        pass
-                
-                recomendaciones.append({
-                    'usuario': candidato_user,
-                    'puntuacion': datos['puntuacion'],
-                    'num_amigos_comun': datos['num_amigos_comun'],
-                    'amigos_comun_nombres': amigos_comun_nombres,
-                    'distancia': datos['distancia']
-                })
-            except User.DoesNotExist:
-                continue
-        
-        # Ordenar por puntuación (mayor primero)
-        recomendaciones.sort(key=lambda x: x['puntuacion'], reverse=True)
-        
-        return recomendaciones[:limite]
+        # Obtener amigos directos (nivel 1) - estos NO son candidatos
+        amigos_directos = set(self.grafo.obtener_amigos(usuario_id))
+        
+        # Excluir usuarios con solicitudes pendientes (enviadas o recibidas)
+        solicitudes_pendientes = SolicitudAmistad.objects.filter(
+            Q(de_usuario=usuario) | Q(para_usuario=usuario),
+            estado='pendiente'
+        ).values_list('de_usuario_id', 'para_usuario_id')
+        
+        con_solicitud = set()
+        for de_usuario_id, para_usuario_id in solicitudes_pendientes:
+            con_solicitud.add(de_usuario_id)
+            con_solicitud.add(para_usuario_id)
+        excluidos = amigos_directos | con_solicitud
+        
+        if self._candidatos_vigentes(usuario):
+            # Los mejores candidatos salen ya ordenados del índice (usuario, -puntuacion)
+            candidatos = RecomendacionCandidato.objects.filter(
+                usuario_id=usuario_id
+            ).exclude(candidato_id__in=excluidos)
+            precalculados = [
+                (fila.candidato, fila.puntuacion, fila.num_amigos_comun, fila.distancia)
+                for fila in candidatos.select_related('candidato__perfil')
+                .order_by('-puntuacion', 'candidato_id')[desplazamiento:desplazamiento + limite]
+            ]
+            ids_candidatos = candidatos.values('candidato_id')
+            contar_candidatos = candidatos.count
+        else:
+            # Falta que actualizar_recomendaciones lo procese: las lecturas
+            # no escriben, así que se calcula en memoria con el mismo tope
+            mejores = heapq.nlargest(
+                self.TOPE_RECOMENDACIONES_CACHE,
+                (
+                    candidato for candidato in self.calcular_candidatos(usuario_id)
+                    if candidato[0] not in excluidos
+                ),
+                key=lambda candidato: (candidato[1], -candidato[0])
+            )
+            pagina = mejores[desplazamiento:desplazamiento + limite]
+            usuarios = User.objects.select_related('perfil').in_bulk(
+                [candidato[0] for candidato in pagina]
+            )
+            precalculados = [
+                (usuarios[candidato_id], puntuacion, num_amigos_comun, distancia)
+                for candidato_id, puntuacion, num_amigos_comun, distancia in pagina
+                if candidato_id in usuarios
+            ]
+            ids_candidatos = [candidato[0] for candidato in mejores]
+            contar_candidatos = mejores.__len__
+        
+        # Nombres de amigos en común a mostrar, con una sola consulta
+        amigos_comun = {
+            candidato.id: self.grafo.amigos_en_comun(usuario_id, candidato.id)[:3]
+            for candidato, _, num_amigos_comun, _ in precalculados
+            if num_amigos_comun
+        }
+        ids_nombres = set()
+        for amigos_ids in amigos_comun.values():
+            ids_nombres.update(amigos_ids)
+        nombres = dict(User.objects.filter(id__in=ids_nombres).values_list('id', 'username'))
+        
+        recomendaciones = [
+            Recomendacion(
+                usuario=candidato,
+                puntuacion=puntuacion,
+                num_amigos_comun=num_amigos_comun,
+                amigos_comun_nombres=[
+                    nombres[amigo_id]
+                    for amigo_id in amigos_comun.get(candidato.id, ())
+                    if amigo_id in nombres
+                ],
+                distancia=distancia
+            )
+            for candidato, puntuacion, num_amigos_comun, distancia in precalculados
+        ]
+        
+        # Si hay pocos candidatos por conexiones, completar con usuarios
+        # lejanos o sin conexión
+        faltantes = limite - len(recomendaciones)
+        if faltantes > 0:
+            # Posición de esta página dentro del relleno (solo se cuenta si
+            # la página no trajo ningún candidato y no es la primera)
+            if precalculados or not desplazamiento:
+                inicio_relleno = 0
+            else:
+                inicio_relleno = desplazamiento - contar_candidatos()
+            
+            recomendaciones.extend(
+                Recomendacion(usuario=candidato, puntuacion=0, num_amigos_comun=0)
+                for candidato in User.objects.exclude(id__in=excluidos | {usuario_id})
+                .exclude(id__in=ids_candidatos)
+                .select_related('perfil')
+                .order_by('-perfil__num_amigos', 'id')[inicio_relleno:inicio_relleno + faltantes]
+            )
+        
+        return recomendaciones
     
     def obtener_estadisticas_grafo(self, usuario):
         """
         Obtiene estadísticas del grafo para mostrar al usuario.
         
+        Normalmente se leen de la instantánea que deja materializar_candidatos
+        en la caché (por usuario y versión del grafo). Si no existe, los
+        usuarios por nivel salen del BFS del grafo en memoria, no de las
+        filas precalculadas, que solo guardan los mejores candidatos.
+        
         Returns:
             dict: Estadísticas del grafo social
         """
         self.grafo.construir_grafo()
         usuario_id = usuario.id
+        clave = self._clave_estadisticas(usuario_id)
+        estadisticas = cache.get(clave)
+        if estadisticas is not None:
+            return estadisticas
         
         niveles = self.grafo.bfs_niveles(usuario_id, nivel_maximo=4)
+        por_distancia = {nivel: len(niveles.get(nivel, ())) for nivel in (2, 3, 4)}
+        estadisticas = self._armar_estadisticas(usuario_id, por_distancia)
+        cache.set(clave, estadisticas, TIEMPO_CACHE_ESTADISTICAS)
+        return estadisticas
+    
+    def _clave_estadisticas(self, usuario_id):
+        """Clave de caché de la instantánea de estadísticas de un usuario."""
+        return f'estadisticas:{usuario_id}:{self.grafo._version}'
+    
+    def _armar_estadisticas(self, usuario_id, por_distancia):
+        """Arma el dict de estadísticas a partir de {distancia: usuarios}."""
+        amigos_directos = len(self.grafo.obtener_amigos(usuario_id))
         
         return {
-            'amigos_directos': len(self.grafo.obtener_amigos(usuario_id)),
-            'nivel_2': len(niveles.get(2, set())),
-            'nivel_3': len(niveles.get(3, set())),
-            'nivel_4': len(niveles.get(4, set())),
+            'amigos_directos': amigos_directos,
+            'nivel_2': por_distancia.get(2, 0),
+            'nivel_3': por_distancia.get(3, 0),
+            'nivel_4': por_distancia.get(4, 0),
             'total_usuarios': len(self.grafo.grafo),
-            'alcance': sum(len(v) for v in niveles.values())
+            'alcance': amigos_directos + sum(por_distancia.values())
         }
+
+def obtener_motor():
+    """
+    Retorna el motor de recomendaciones compartido por el proceso.
+    
+    El motor se crea una sola vez; en cada llamada solo se comprueba la
+    versión del grafo, que se reconstruye únicamente si cambió.
+    """
+    global _motor
+    if _motor is None:
+        _motor = MotorRecomendaciones()
+    _motor.grafo.construir_grafo()
+    return _motor
@@ -0,0 +1,32 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from usuarios.graph_engine import MotorRecomendaciones
+
+
+class Command(BaseCommand):
+    """
+    Recalcula los candidatos a recomendación fuera de las peticiones.
+    
+    Las señales de Amistad solo encolan a los usuarios afectados; este
+    comando se ejecuta periódicamente (cron o similar, una sola instancia a
+    la vez) para procesar esa cola.
+    """
+    help = 'Recalcula los candidatos a recomendación pendientes'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--todos',
+            action='store_true',
+            help='Recalcula los candidatos de todos los usuarios, no solo los pendientes',
+        )
+    
+    def handle(self, *args, **options):
+        motor = MotorRecomendaciones()
+        if options['todos']:
+            usuario_ids = list(User.objects.values_list('id', flat=True))
+            motor.materializar_candidatos(usuario_ids)
+            total = len(usuario_ids)
+        else:
+            total = len(motor.procesar_recalculos_pendientes())
+        self.stdout.write(self.style.SUCCESS(f'✓ Candidatos recalculados para {total} usuarios'))
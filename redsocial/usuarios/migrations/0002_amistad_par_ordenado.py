@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-14 03:53
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def ordenar_amistades(apps, schema_editor):
+    """Deja cada amistad existente con usuario1_id < usuario2_id."""
+    Amistad = apps.get_model('usuarios', 'Amistad')
+    for amistad in Amistad.objects.filter(usuario1__gt=models.F('usuario2')):
+        duplicada = Amistad.objects.filter(
+            usuario1_id=amistad.usuario2_id,
+            usuario2_id=amistad.usuario1_id,
+        ).exists()
+        if duplicada:
+            amistad.delete()
+        else:
+            amistad.usuario1_id, amistad.usuario2_id = amistad.usuario2_id, amistad.usuario1_id
+            amistad.save(update_fields=['usuario1', 'usuario2'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(ordenar_amistades, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='amistad',
+            constraint=models.CheckConstraint(condition=models.Q(('usuario1__lt', models.F('usuario2'))), name='amistad_par_ordenado'),
+        ),
+    ]
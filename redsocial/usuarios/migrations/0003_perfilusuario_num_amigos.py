@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-14 03:57
+
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def calcular_num_amigos(apps, schema_editor):
+    """Inicializa el contador de amigos a partir de las amistades existentes."""
+    Amistad = apps.get_model('usuarios', 'Amistad')
+    PerfilUsuario = apps.get_model('usuarios', 'PerfilUsuario')
+    
+    conteos = Counter()
+    for usuario1_id, usuario2_id in Amistad.objects.values_list('usuario1_id', 'usuario2_id'):
+        conteos[usuario1_id] += 1
+        conteos[usuario2_id] += 1
+    
+    perfiles = list(PerfilUsuario.objects.filter(usuario_id__in=conteos))
+    for perfil in perfiles:
+        perfil.num_amigos = conteos[perfil.usuario_id]
+    PerfilUsuario.objects.bulk_update(perfiles, ['num_amigos'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0002_amistad_par_ordenado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perfilusuario',
+            name='num_amigos',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(calcular_num_amigos, migrations.RunPython.noop),
+    ]
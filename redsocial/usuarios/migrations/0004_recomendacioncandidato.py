@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-14 04:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0003_perfilusuario_num_amigos'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecomendacionCandidato',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('puntuacion', models.PositiveIntegerField(default=0)),
+                ('num_amigos_comun', models.PositiveIntegerField(default=0)),
+                ('distancia', models.PositiveSmallIntegerField()),
+                ('candidato', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='candidatos_recomendados', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Candidato a Recomendación',
+                'verbose_name_plural': 'Candidatos a Recomendación',
+                'indexes': [models.Index(fields=['usuario', '-puntuacion'], name='rec_usuario_puntuacion_idx')],
+                'unique_together': {('usuario', 'candidato')},
+            },
+        ),
+    ]
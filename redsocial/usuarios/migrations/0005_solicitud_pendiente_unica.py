@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-14 04:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0004_recomendacioncandidato'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='solicitudamistad',
+            unique_together=set(),
+        ),
+        migrations.AddConstraint(
+            model_name='solicitudamistad',
+            constraint=models.UniqueConstraint(condition=models.Q(('estado', 'pendiente')), fields=('de_usuario', 'para_usuario'), name='solicitud_pendiente_unica'),
+        ),
+    ]
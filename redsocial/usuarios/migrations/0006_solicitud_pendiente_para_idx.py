@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-14 04:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0005_solicitud_pendiente_unica'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='solicitudamistad',
+            index=models.Index(condition=models.Q(('estado', 'pendiente')), fields=['para_usuario', 'de_usuario'], name='sol_pendiente_para_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-14 04:24
+
+from django.conf import settings
+from django.db import migrations
+
+
+# Columnas de auth_user que recorre la búsqueda de usuarios (icontains)
+COLUMNAS_BUSQUEDA = ['username', 'first_name', 'last_name']
+
+
+def crear_indices_trigram(apps, schema_editor):
+    """
+    En PostgreSQL crea índices GIN de trigramas sobre UPPER(columna), que es
+    la expresión que genera icontains, para que LIKE '%texto%' use el índice.
+    En otros motores (SQLite en desarrollo) no hace nada.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    tabla = schema_editor.quote_name(apps.get_model(settings.AUTH_USER_MODEL)._meta.db_table)
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for columna in COLUMNAS_BUSQUEDA:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS usuarios_busqueda_{columna}_trgm '
+            f'ON {tabla} USING gin (UPPER({schema_editor.quote_name(columna)}::text) gin_trgm_ops)'
+        )
+
+
+def eliminar_indices_trigram(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for columna in COLUMNAS_BUSQUEDA:
+        schema_editor.execute(f'DROP INDEX IF EXISTS usuarios_busqueda_{columna}_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0006_solicitud_pendiente_para_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indices_trigram, eliminar_indices_trigram),
+    ]
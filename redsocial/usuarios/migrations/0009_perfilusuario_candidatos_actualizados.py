@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-14 04:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usuarios', '0008_recalculopendiente'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='perfilusuario',
+            name='candidatos_actualizados',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -1,8 +1,18 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
+from .graph_engine import (
+    CLAVE_VERSION_PERFILES,
+    CLAVE_VERSION_SOLICITUDES,
+    incrementar_version,
+    invalidar_grafo,
+    invalidar_dashboard,
+    obtener_version_grafo
+)
+
 
 class PerfilUsuario(models.Model):
     """
@@ -15,6 +25,10 @@ class PerfilUsuario(models.Model):
     ubicacion = models.CharField(max_length=100, blank=True, default='')
     fecha_nacimiento = models.DateField(null=True, blank=True)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
+    # Contador desnormalizado, mantenido por las señales de Amistad
+    num_amigos = models.PositiveIntegerField(default=0, db_index=True)
+    # Última vez que se guardaron sus candidatos a recomendación (None: nunca)
+    candidatos_actualizados = models.DateTimeField(null=True, blank=True, db_index=True)
     
     class Meta:
         verbose_name = 'Perfil de Usuario'
@@ -23,22 +37,52 @@ class PerfilUsuario(models.Model):
     def __str__(self):
         return f'Perfil de {self.usuario.username}'
     
+    def amigos_queryset(self):
+        """
+        Retorna el QuerySet base (sin evaluar) de los amigos del usuario.
+        
+        Sirve para contar, comprobar existencia o leer solo IDs sin traer
+        filas completas de User.
+        """
+        return User.objects.filter(
+            models.Q(id__in=Amistad.objects.filter(
+                usuario1=self.usuario
+            ).values('usuario2_id')) |
+            models.Q(id__in=Amistad.objects.filter(
+                usuario2=self.usuario
+            ).values('usuario1_id'))
+        )
+    
     def obtener_amigos(self):
-        """Retorna todos los amigos confirmados del usuario."""
-        amistades = Amistad.objects.filter(
-            models.Q(usuario1=self.usuario) | models.Q(usuario2=self.usuario)
+        """
+        Retorna todos los amigos confirmados del usuario (QuerySet de User).
+        
+        Incluye el perfil de cada amigo en la misma consulta y carga solo las
+        columnas que usan las plantillas de listas de amigos.
+        """
+        return self.amigos_queryset().select_related('perfil').only(
+            'id', 'username', 'first_name', 'last_name',
+            'perfil__foto', 'perfil__ubicacion'
         )
-        amigos = []
-        for amistad in amistades:
-            if amistad.usuario1 == self.usuario:
-                amigos.append(amistad.usuario2)
-            else:
-                amigos.append(amistad.usuario1)
-        return amigos
     
     def contar_amigos(self):
         """Retorna el número de amigos."""
-        return len(self.obtener_amigos())
+        return self.num_amigos
+    
+    def obtener_conteos(self):
+        """
+        Retorna el número de amigos y de solicitudes pendientes recibidas
+        leídos de la base de datos en una sola consulta.
+        
+        Returns:
+            dict: {num_amigos, solicitudes_pendientes}
+        """
+        return PerfilUsuario.objects.filter(pk=self.pk).annotate(
+            solicitudes_pendientes=models.Count(
+                'usuario__solicitudes_recibidas',
+                filter=models.Q(usuario__solicitudes_recibidas__estado='pendiente')
+            )
+        ).values('num_amigos', 'solicitudes_pendientes').get()
     
     def solicitudes_pendientes_recibidas(self):
         """Retorna las solicitudes de amistad pendientes recibidas."""
@@ -82,7 +126,22 @@ class SolicitudAmistad(models.Model):
     class Meta:
         verbose_name = 'Solicitud de Amistad'
         verbose_name_plural = 'Solicitudes de Amistad'
-        unique_together = ('de_usuario', 'para_usuario')
+        constraints = [
+            # Solo una solicitud pendiente por par; las respondidas quedan como historial
+            models.UniqueConstraint(
+                fields=['de_usuario', 'para_usuario'],
+                condition=models.Q(estado='pendiente'),
+                name='solicitud_pendiente_unica',
+            ),
+        ]
+        indexes = [
+            # Búsquedas de pendientes por destinatario (badge, listas y solicitudes recibidas)
+            models.Index(
+                fields=['para_usuario', 'de_usuario'],
+                condition=models.Q(estado='pendiente'),
+                name='sol_pendiente_para_idx',
+            ),
+        ]
     
     def __str__(self):
         return f'{self.de_usuario.username} → {self.para_usuario.username} ({self.estado})'
@@ -94,9 +153,10 @@ class SolicitudAmistad(models.Model):
         self.fecha_respuesta = timezone.now()
         self.save()
         # Crear la amistad bidireccional
+        usuario1, usuario2 = Amistad.ordenar_par(self.de_usuario, self.para_usuario)
         Amistad.objects.get_or_create(
-            usuario1=self.de_usuario,
-            usuario2=self.para_usuario
+            usuario1=usuario1,
+            usuario2=usuario2
         )
     
     def rechazar(self):
@@ -111,6 +171,9 @@ class Amistad(models.Model):
     """
     Modelo para representar una amistad confirmada entre dos usuarios.
     Esta es una arista en el grafo social.
+    
+    Cada par se guarda en orden canónico (usuario1_id < usuario2_id), así
+    una amistad se consulta con una sola búsqueda sobre el índice único.
     """
     usuario1 = models.ForeignKey(
         User, 
@@ -128,17 +191,114 @@ class Amistad(models.Model):
         verbose_name = 'Amistad'
         verbose_name_plural = 'Amistades'
         unique_together = ('usuario1', 'usuario2')
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(usuario1__lt=models.F('usuario2')),
+                name='amistad_par_ordenado',
+            ),
+        ]
     
     def __str__(self):
         return f'{self.usuario1.username} ↔ {self.usuario2.username}'
     
+    def save(self, *args, **kwargs):
+        """Guarda la amistad con el par de usuarios en orden canónico."""
+        # Se intercambian los ids: asignar las relaciones cargaría ambos User
+        if self.usuario1_id > self.usuario2_id:
+            self.usuario1_id, self.usuario2_id = self.usuario2_id, self.usuario1_id
+        super().save(*args, **kwargs)
+    
+    @staticmethod
+    def ordenar_par(usuario1, usuario2):
+        """Retorna los dos usuarios en orden canónico (menor id primero)."""
+        if usuario1.id > usuario2.id:
+            return usuario2, usuario1
+        return usuario1, usuario2
+    
+    @classmethod
+    def ids_amigos(cls, usuario):
+        """
+        Retorna un frozenset con los IDs de los amigos de un usuario.
+        
+        El resultado se guarda en la propia instancia junto con la versión
+        del grafo, así que durante una petición solo se consulta una vez y
+        cualquier cambio de amistades (que incrementa la versión) lo descarta.
+        """
+        version = obtener_version_grafo()
+        guardado = getattr(usuario, '_ids_amigos', None)
+        if guardado is not None and guardado[0] == version:
+            return guardado[1]
+        
+        ids = frozenset(
+            cls.objects.filter(
+                models.Q(usuario1=usuario) | models.Q(usuario2=usuario)
+            ).annotate(
+                otro_id=models.Case(
+                    models.When(usuario1=usuario, then=F('usuario2_id')),
+                    default=F('usuario1_id'),
+                )
+            ).values_list('otro_id', flat=True)
+        )
+        usuario._ids_amigos = (version, ids)
+        return ids
+    
     @classmethod
     def son_amigos(cls, usuario1, usuario2):
         """Verifica si dos usuarios son amigos."""
-        return cls.objects.filter(
-            models.Q(usuario1=usuario1, usuario2=usuario2) |
-            models.Q(usuario1=usuario2, usuario2=usuario1)
-        ).exists()
+        return usuario2.id in cls.ids_amigos(usuario1)
+
+
+class RecomendacionCandidato(models.Model):
+    """
+    Candidato a recomendación precalculado para un usuario (distancia 2 a 4).
+    Desnormaliza el resultado del motor de grafos para servir las
+    recomendaciones con una consulta indexada en lugar de recorrer el grafo.
+    """
+    usuario = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='candidatos_recomendados'
+    )
+    candidato = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    puntuacion = models.PositiveIntegerField(default=0)
+    num_amigos_comun = models.PositiveIntegerField(default=0)
+    distancia = models.PositiveSmallIntegerField()
+    
+    class Meta:
+        verbose_name = 'Candidato a Recomendación'
+        verbose_name_plural = 'Candidatos a Recomendación'
+        unique_together = ('usuario', 'candidato')
+        indexes = [
+            models.Index(fields=['usuario', '-puntuacion'], name='rec_usuario_puntuacion_idx'),
+        ]
+    
+    def __str__(self):
+        return f'{self.usuario.username} → {self.candidato.username} ({self.puntuacion})'
+
+
+class RecalculoPendiente(models.Model):
+    """
+    Usuario extremo de una amistad creada o eliminada cuyo vecindario aún
+    no tiene los candidatos a recomendación recalculados.
+    La cola la vacía el comando actualizar_recomendaciones.
+    """
+    usuario = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Recálculo Pendiente'
+        verbose_name_plural = 'Recálculos Pendientes'
+    
+    def __str__(self):
+        return f'Recalcular vecindario de {self.usuario.username}'
 
 
 # Señales para crear automáticamente el perfil cuando se crea un usuario
@@ -148,9 +308,114 @@ def crear_perfil_usuario(sender, instance, created, **kwargs):
         PerfilUsuario.objects.create(usuario=instance)
 
 
+# Señales para invalidar el grafo social en caché cuando cambian las amistades.
+# La versión se cambia en el acto, para que el propio proceso vea el cambio
+# dentro de la transacción, y otra vez al confirmarla: un grafo que otro
+# proceso haya reconstruido antes del commit (sin la fila nueva) queda guardado
+# con una versión ya descartada.
+def _invalidar_grafo():
+    invalidar_grafo()
+    transaction.on_commit(invalidar_grafo)
+
+
+@receiver(post_save, sender=Amistad)
+@receiver(post_delete, sender=Amistad)
+def invalidar_grafo_amistad(sender, **kwargs):
+    _invalidar_grafo()
+
+
+# Señales para mantener el contador de amigos de cada perfil
+@receiver(post_save, sender=Amistad)
+def incrementar_num_amigos(sender, instance, created, **kwargs):
+    if created:
+        PerfilUsuario.objects.filter(
+            usuario_id__in=[instance.usuario1_id, instance.usuario2_id]
+        ).update(num_amigos=F('num_amigos') + 1)
+
+
+@receiver(post_delete, sender=Amistad)
+def decrementar_num_amigos(sender, instance, **kwargs):
+    PerfilUsuario.objects.filter(
+        usuario_id__in=[instance.usuario1_id, instance.usuario2_id],
+        num_amigos__gt=0
+    ).update(num_amigos=F('num_amigos') - 1)
+
+
 @receiver(post_save, sender=User)
-def guardar_perfil_usuario(sender, instance, **kwargs):
-    try:
-        instance.perfil.save()
-    except PerfilUsuario.DoesNotExist:
-        PerfilUsuario.objects.create(usuario=instance)
+def invalidar_grafo_usuario_creado(sender, instance, created, **kwargs):
+    if created:
+        _invalidar_grafo()
+
+
+@receiver(post_delete, sender=User)
+def invalidar_grafo_usuario_eliminado(sender, **kwargs):
+    _invalidar_grafo()
+
+
+# Señales para encolar el recálculo de los candidatos afectados por una amistad.
+# Los extremos de todas las amistades de una transacción (por ejemplo, las que
+# se borran en cascada al eliminar un usuario) se juntan en un conjunto por
+# conexión y se encolan con un solo INSERT al confirmar la transacción. Si una
+# transacción se revierte, sus ids se encolan con la siguiente que se confirme:
+# solo cuesta recalcular de más, nunca se pierde un recálculo.
+def _encolar_recalculo(amistad):
+    conexion = transaction.get_connection()
+    pendientes = getattr(conexion, 'recalculos_pendientes', None)
+    if pendientes is None:
+        pendientes = conexion.recalculos_pendientes = set()
+    pendientes.update((amistad.usuario1_id, amistad.usuario2_id))
+    
+    def encolar():
+        # El primer callback que se ejecuta vacía el conjunto; los demás de
+        # la misma transacción ya no encuentran nada que encolar
+        usuario_ids = set(conexion.recalculos_pendientes)
+        conexion.recalculos_pendientes.clear()
+        if usuario_ids:
+            RecalculoPendiente.objects.bulk_create(
+                RecalculoPendiente(usuario_id=usuario_id)
+                for usuario_id in User.objects.filter(id__in=usuario_ids).values_list('id', flat=True)
+            )
+    
+    transaction.on_commit(encolar)
+
+
+@receiver(post_save, sender=Amistad)
+def encolar_recalculo_amistad_creada(sender, instance, created, **kwargs):
+    if created:
+        _encolar_recalculo(instance)
+
+
+@receiver(post_delete, sender=Amistad)
+def encolar_recalculo_amistad_eliminada(sender, instance, **kwargs):
+    _encolar_recalculo(instance)
+
+
+# Señales para descartar el dashboard en caché de ambos usuarios de una solicitud
+@receiver(post_save, sender=SolicitudAmistad)
+@receiver(post_delete, sender=SolicitudAmistad)
+def invalidar_dashboard_solicitud(sender, instance, **kwargs):
+    invalidar_dashboard(instance.de_usuario_id, instance.para_usuario_id)
+
+
+# Señales para cambiar las versiones que forman el ETag de las páginas
+@receiver(post_save, sender=SolicitudAmistad)
+@receiver(post_delete, sender=SolicitudAmistad)
+def incrementar_version_solicitudes(sender, instance, **kwargs):
+    for usuario_id in (instance.de_usuario_id, instance.para_usuario_id):
+        incrementar_version(CLAVE_VERSION_SOLICITUDES.format(usuario_id=usuario_id))
+
+
+# Campos que muestran las plantillas; guardar otros (por ejemplo last_login en
+# cada inicio de sesión) no debe cambiar el ETag de las páginas de todos
+CAMPOS_VISIBLES_PERFILES = {
+    User: frozenset({'username', 'first_name', 'last_name', 'email'}),
+    PerfilUsuario: frozenset({'foto', 'bio', 'ubicacion', 'fecha_nacimiento'}),
+}
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=PerfilUsuario)
+def incrementar_version_perfiles(sender, update_fields=None, **kwargs):
+    if update_fields is not None and CAMPOS_VISIBLES_PERFILES[sender].isdisjoint(update_fields):
+        return
+    incrementar_version(CLAVE_VERSION_PERFILES)
@@ -1,3 +1,301 @@
-from django.test import TestCase
+from io import StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .graph_engine import CLAVE_VERSION_PERFILES, MotorRecomendaciones, obtener_version
+from .models import Amistad, PerfilUsuario, RecalculoPendiente, RecomendacionCandidato
+
+
+# Caché en memoria para que las pruebas no compartan versiones con la de desarrollo
+CACHE_PRUEBAS = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+}
+
+# Grafo de prueba: ana - carlos - juan, ana - maria - sofia, carlos - diego - lucia - elena
+AMISTADES = [
+    ('ana', 'carlos'), ('ana', 'maria'), ('carlos', 'juan'), ('carlos', 'diego'),
+    ('maria', 'sofia'), ('diego', 'lucia'), ('lucia', 'elena'),
+]
+
+
+def crear_usuarios(*nombres):
+    """Crea usuarios de prueba y los retorna en un dict por nombre."""
+    return {
+        nombre: User.objects.create_user(nombre, password='clave-segura-123', first_name=nombre.title())
+        for nombre in nombres
+    }
+
+
+@override_settings(CACHES=CACHE_PRUEBAS)
+class RedSocialTestCase(TestCase):
+    """Crea el grafo de prueba; los on_commit de setUp no se ejecutan."""
+
+    def setUp(self):
+        self.usuarios = crear_usuarios(*sorted({nombre for par in AMISTADES for nombre in par}))
+        for nombre1, nombre2 in AMISTADES:
+            Amistad.objects.create(usuario1=self.usuarios[nombre1], usuario2=self.usuarios[nombre2])
+        # Descartar lo encolado por setUp, que en TestCase nunca se confirma
+        getattr(connection, 'recalculos_pendientes', set()).clear()
+
+    def num_amigos(self, nombre):
+        return PerfilUsuario.objects.get(usuario__username=nombre).num_amigos
+
+
+class AmistadOrdenTests(RedSocialTestCase):
+    """Par canónico de Amistad (usuario1_id < usuario2_id)."""
+
+    def test_save_ordena_el_par(self):
+        juan, sofia = self.usuarios['juan'], self.usuarios['sofia']
+        mayor, menor = (juan, sofia) if juan.id > sofia.id else (sofia, juan)
+        amistad = Amistad.objects.create(usuario1=mayor, usuario2=menor)
+        self.assertEqual((amistad.usuario1_id, amistad.usuario2_id), (menor.id, mayor.id))
+        # La relación cacheada no queda apuntando al usuario anterior
+        self.assertEqual(amistad.usuario1, menor)
+        amistad.refresh_from_db()
+        self.assertEqual((amistad.usuario1_id, amistad.usuario2_id), (menor.id, mayor.id))
+
+    def test_save_no_carga_los_usuarios(self):
+        juan, sofia = self.usuarios['juan'], self.usuarios['sofia']
+        amistad = Amistad(usuario1_id=max(juan.id, sofia.id), usuario2_id=min(juan.id, sofia.id))
+        with CaptureQueriesContext(connection) as consultas:
+            amistad.save()
+        self.assertFalse([
+            consulta['sql'] for consulta in consultas.captured_queries
+            if consulta['sql'].startswith('SELECT') and '"auth_user"' in consulta['sql']
+        ])
+
+    def test_par_invertido_duplicado(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Amistad.objects.create(usuario1=self.usuarios['carlos'], usuario2=self.usuarios['ana'])
+
+    def test_restriccion_par_ordenado(self):
+        ana, juan = self.usuarios['ana'], self.usuarios['juan']
+        mayor, menor = (ana, juan) if ana.id > juan.id else (juan, ana)
+        # bulk_create no pasa por save: la CheckConstraint es la que lo impide
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Amistad.objects.bulk_create([Amistad(usuario1=mayor, usuario2=menor)])
+
+    def test_son_amigos_en_ambos_sentidos(self):
+        ana, carlos, juan = self.usuarios['ana'], self.usuarios['carlos'], self.usuarios['juan']
+        self.assertTrue(Amistad.son_amigos(ana, carlos))
+        self.assertTrue(Amistad.son_amigos(carlos, ana))
+        self.assertFalse(Amistad.son_amigos(ana, juan))
+
+
+class NumAmigosTests(RedSocialTestCase):
+    """Contador num_amigos mantenido por las señales de Amistad."""
+
+    def test_conteo_inicial(self):
+        self.assertEqual(self.num_amigos('carlos'), 3)
+        self.assertEqual(self.num_amigos('elena'), 1)
+        self.assertEqual(
+            self.usuarios['carlos'].perfil.amigos_queryset().count(), self.num_amigos('carlos')
+        )
+
+    def test_crear_y_eliminar_amistad(self):
+        Amistad.objects.create(usuario1=self.usuarios['juan'], usuario2=self.usuarios['sofia'])
+        self.assertEqual(self.num_amigos('juan'), 2)
+        self.assertEqual(self.num_amigos('sofia'), 2)
+
+        usuario1, usuario2 = Amistad.ordenar_par(self.usuarios['juan'], self.usuarios['sofia'])
+        Amistad.objects.filter(usuario1=usuario1, usuario2=usuario2).delete()
+        self.assertEqual(self.num_amigos('juan'), 1)
+        self.assertEqual(self.num_amigos('sofia'), 1)
+
+    def test_eliminar_usuario_en_cascada(self):
+        self.usuarios['carlos'].delete()
+        self.assertEqual(self.num_amigos('ana'), 1)
+        self.assertEqual(self.num_amigos('juan'), 0)
+        self.assertEqual(self.num_amigos('diego'), 1)
+
+    def test_aceptar_solicitud(self):
+        from .models import SolicitudAmistad
+
+        solicitud = SolicitudAmistad.objects.create(
+            de_usuario=self.usuarios['elena'], para_usuario=self.usuarios['sofia']
+        )
+        solicitud.aceptar()
+        self.assertTrue(Amistad.son_amigos(self.usuarios['sofia'], self.usuarios['elena']))
+        self.assertEqual(self.num_amigos('elena'), 2)
+
+
+class RecalculoPendienteTests(RedSocialTestCase):
+    """Cola de recálculo al confirmar y comando actualizar_recomendaciones."""
+
+    def filas(self):
+        return sorted(RecomendacionCandidato.objects.values_list(
+            'usuario_id', 'candidato_id', 'puntuacion', 'num_amigos_comun', 'distancia'
+        ))
+
+    def esperado(self):
+        motor = MotorRecomendaciones()
+        return sorted(
+            (usuario_id, *candidato)
+            for usuario_id in User.objects.values_list('id', flat=True)
+            for candidato in motor.calcular_candidatos(usuario_id)
+        )
+
+    def test_encola_extremos_al_confirmar(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Amistad.objects.create(usuario1=self.usuarios['juan'], usuario2=self.usuarios['sofia'])
+        self.assertEqual(
+            sorted(RecalculoPendiente.objects.values_list('usuario__username', flat=True)),
+            ['juan', 'sofia']
+        )
+
+    def test_no_encola_si_no_se_confirma(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            Amistad.objects.create(usuario1=self.usuarios['juan'], usuario2=self.usuarios['sofia'])
+        self.assertFalse(RecalculoPendiente.objects.exists())
+
+    def test_eliminar_usuario_encola_con_un_insert(self):
+        with CaptureQueriesContext(connection) as consultas:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.usuarios['carlos'].delete()
+        inserts = [
+            consulta['sql'] for consulta in consultas.captured_queries
+            if consulta['sql'].startswith('INSERT') and 'recalculopendiente' in consulta['sql']
+        ]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(
+            sorted(RecalculoPendiente.objects.values_list('usuario__username', flat=True)),
+            ['ana', 'diego', 'juan']
+        )
+
+    def test_comando_procesa_la_cola(self):
+        call_command('actualizar_recomendaciones', stdout=StringIO())
+        self.assertFalse(PerfilUsuario.objects.filter(candidatos_actualizados__isnull=True).exists())
+        self.assertEqual(self.filas(), self.esperado())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Amistad.objects.create(usuario1=self.usuarios['elena'], usuario2=self.usuarios['sofia'])
+        self.assertNotEqual(self.filas(), self.esperado())
+
+        call_command('actualizar_recomendaciones', stdout=StringIO())
+        self.assertFalse(RecalculoPendiente.objects.exists())
+        self.assertEqual(self.filas(), self.esperado())
+
+    def test_guarda_solo_los_mejores(self):
+        motor = MotorRecomendaciones()
+        motor.TOPE_RECOMENDACIONES_CACHE = 2
+        usuario_ids = list(User.objects.values_list('id', flat=True))
+        motor.materializar_candidatos(usuario_ids)
+        mejores = sorted(
+            (usuario_id, *candidato)
+            for usuario_id in usuario_ids
+            for candidato in sorted(
+                motor.calcular_candidatos(usuario_id), key=lambda c: (-c[1], c[0])
+            )[:2]
+        )
+        self.assertEqual(self.filas(), mejores)
+
+    def test_pendiente_usa_el_calculo_en_memoria(self):
+        call_command('actualizar_recomendaciones', stdout=StringIO())
+        with self.captureOnCommitCallbacks(execute=True):
+            Amistad.objects.create(usuario1=self.usuarios['elena'], usuario2=self.usuarios['sofia'])
+        sofia = User.objects.select_related('perfil').get(username='sofia')
+        distancias = {
+            rec.usuario.username: rec.distancia
+            for rec in MotorRecomendaciones().obtener_recomendaciones(sofia, limite=20)
+        }
+        self.assertEqual(distancias['lucia'], 2)
+
+
+class ETagTests(RedSocialTestCase):
+    """Respuestas 304/200 de las páginas con etag_usuario."""
+
+    def setUp(self):
+        super().setUp()
+        self.cliente = Client()
+        self.cliente.force_login(self.usuarios['sofia'])
+
+    def test_revalidacion_sin_cambios(self):
+        for nombre in ['lista_amigos', 'solicitudes', 'recomendaciones', 'recomendaciones_api']:
+            respuesta = self.cliente.get(reverse(nombre))
+            self.assertEqual(respuesta.status_code, 200)
+            self.assertIn('must-revalidate', respuesta['Cache-Control'])
+            revalidacion = self.cliente.get(reverse(nombre), HTTP_IF_NONE_MATCH=respuesta['ETag'])
+            self.assertEqual(revalidacion.status_code, 304)
+
+    def test_etag_cambia_con_una_amistad(self):
+        etag = self.cliente.get(reverse('recomendaciones'))['ETag']
+        Amistad.objects.create(usuario1=self.usuarios['elena'], usuario2=self.usuarios['sofia'])
+        respuesta = self.cliente.get(reverse('recomendaciones'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+
+    def test_etag_cambia_tras_el_comando(self):
+        call_command('actualizar_recomendaciones', stdout=StringIO())
+        with self.captureOnCommitCallbacks(execute=True):
+            Amistad.objects.create(usuario1=self.usuarios['elena'], usuario2=self.usuarios['sofia'])
+        etags = {
+            nombre: self.cliente.get(reverse(nombre))['ETag']
+            for nombre in ['recomendaciones', 'recomendaciones_api']
+        }
+        call_command('actualizar_recomendaciones', stdout=StringIO())
+        for nombre, etag in etags.items():
+            respuesta = self.cliente.get(reverse(nombre), HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(respuesta.status_code, 200)
+
+    def test_inicio_de_sesion_no_cambia_etag(self):
+        version = obtener_version(CLAVE_VERSION_PERFILES)
+        etag = self.cliente.get(reverse('lista_amigos'))['ETag']
+        Client().force_login(self.usuarios['ana'])
+        self.assertEqual(obtener_version(CLAVE_VERSION_PERFILES), version)
+        respuesta = self.cliente.get(reverse('lista_amigos'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 304)
+
+    def test_editar_nombre_cambia_etag(self):
+        etag = self.cliente.get(reverse('lista_amigos'))['ETag']
+        maria = self.usuarios['maria']
+        maria.first_name = 'Mariana'
+        maria.save(update_fields=['first_name'])
+        respuesta = self.cliente.get(reverse('lista_amigos'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(respuesta.status_code, 200)
+
+
+@override_settings(CACHES=CACHE_PRUEBAS)
+class MigracionParOrdenadoTests(TransactionTestCase):
+    """Migraciones 0002 (ordenar y deduplicar) y 0003 (num_amigos)."""
+
+    antes = [('usuarios', '0001_initial')]
+    despues = [('usuarios', '0003_perfilusuario_num_amigos')]
+
+    def migrar(self, destino):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(destino)
+        return executor.loader.project_state(destino).apps
+
+    def tearDown(self):
+        self.migrar(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_ordena_y_deduplica(self):
+        apps = self.migrar(self.antes)
+        UsuarioHistorico = apps.get_model('auth', 'User')
+        PerfilHistorico = apps.get_model('usuarios', 'PerfilUsuario')
+        AmistadHistorica = apps.get_model('usuarios', 'Amistad')
+
+        a, b, c = (UsuarioHistorico.objects.create(username=nombre) for nombre in 'abc')
+        for usuario in (a, b, c):
+            PerfilHistorico.objects.create(usuario=usuario)
+        AmistadHistorica.objects.create(usuario1=b, usuario2=a)  # invertida
+        AmistadHistorica.objects.create(usuario1=a, usuario2=c)
+        AmistadHistorica.objects.create(usuario1=c, usuario2=a)  # duplicada invertida
+
+        apps = self.migrar(self.despues)
+        AmistadHistorica = apps.get_model('usuarios', 'Amistad')
+        PerfilHistorico = apps.get_model('usuarios', 'PerfilUsuario')
+        self.assertEqual(
+            sorted(AmistadHistorica.objects.values_list('usuario1_id', 'usuario2_id')),
+            [(a.id, b.id), (a.id, c.id)]
+        )
+        self.assertEqual(
+            dict(PerfilHistorico.objects.values_list('usuario_id', 'num_amigos')),
+            {a.id: 2, b.id: 1, c.id: 1}
+        )
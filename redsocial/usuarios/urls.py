@@ -29,6 +29,7 @@ urlpatterns = [
     
     # Recomendaciones
     path('recomendaciones/', views.recomendaciones_view, name='recomendaciones'),
+    path('recomendaciones/api/', views.recomendaciones_api_view, name='recomendaciones_api'),
     
     # Búsqueda
     path('buscar/', views.buscar_usuarios_view, name='buscar_usuarios'),
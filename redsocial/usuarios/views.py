@@ -3,8 +3,13 @@ from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib import messages
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
 from django.db.models import Q
 from django.http import JsonResponse
+from django.urls import reverse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import etag
 
 from .models import PerfilUsuario, SolicitudAmistad, Amistad
 from .forms import (
@@ -14,8 +19,52 @@ from .forms import (
     FormularioEditarUsuario,
     FormularioBusqueda
 )
-from .graph_engine import MotorRecomendaciones
+from .graph_engine import (
+    CLAVE_VERSION_CANDIDATOS,
+    CLAVE_VERSION_GRAFO,
+    CLAVE_VERSION_PERFILES,
+    CLAVE_VERSION_SOLICITUDES,
+    clave_dashboard,
+    obtener_motor,
+    obtener_versiones,
+    Recomendacion,
+    TIEMPO_CACHE_DASHBOARD
+)
+
+
+# Amigos que se muestran en la tarjeta de amigos del perfil
+AMIGOS_EN_PERFIL = 12
 
+# Recomendaciones por página y total que se cargan en la página de Descubrir
+RECOMENDACIONES_POR_PAGINA = 5
+MAX_RECOMENDACIONES = 20
+
+
+
+def etag_usuario(request, *args, **kwargs):
+    """
+    ETag de las páginas que solo dependen del usuario, del grafo de
+    amistades, de sus solicitudes, de sus candidatos a recomendación
+    guardados y de los perfiles.
+    
+    Las versiones se leen de la caché compartida (ver settings.CACHES), así
+    que un cambio hecho en cualquier proceso cambia el ETag en todos.
+    
+    Si hay mensajes pendientes no se genera ETag, para que la página se
+    renderice y los muestre en lugar de responder 304.
+    """
+    if not request.user.is_authenticated or len(messages.get_messages(request)):
+        return None
+    return '{}:{}:{}:{}:{}'.format(request.user.id, *obtener_versiones(
+        CLAVE_VERSION_GRAFO,
+        CLAVE_VERSION_SOLICITUDES.format(usuario_id=request.user.id),
+        CLAVE_VERSION_CANDIDATOS.format(usuario_id=request.user.id),
+        CLAVE_VERSION_PERFILES,
+    ))
+
+
+# Obliga al navegador a revalidar con If-None-Match en cada visita
+revalidar = cache_control(private=True, max_age=0, must_revalidate=True)
 
 # ============== VISTAS DE AUTENTICACIÓN ==============
 
@@ -69,29 +118,58 @@ def logout_view(request):
 
 # ============== VISTAS PRINCIPALES ==============
 
+def _datos_dashboard(usuario):
+    """
+    Calcula los datos del dashboard que se guardan en caché.
+    
+    Solo se guardan primitivas e IDs; los usuarios se vuelven a cargar en
+    cada petición para que nombres y fotos estén siempre al día.
+    """
+    perfil = usuario.perfil
+    motor = obtener_motor()
+    recomendaciones = motor.obtener_recomendaciones(usuario, limite=5)
+    
+    return {
+        **perfil.obtener_conteos(),
+        'recomendaciones': [
+            (rec.usuario.id, rec.puntuacion, rec.num_amigos_comun,
+             rec.amigos_comun_nombres, rec.distancia)
+            for rec in recomendaciones
+        ],
+        'estadisticas_grafo': motor.obtener_estadisticas_grafo(usuario),
+        'amigos_ids': list(perfil.amigos_queryset().values_list('id', flat=True)[:6]),
+    }
+
+
 @login_required
 def dashboard_view(request):
     """Vista del dashboard principal del usuario."""
     perfil = request.user.perfil
     
-    # Obtener estadísticas
-    num_amigos = perfil.contar_amigos()
-    solicitudes_pendientes = perfil.solicitudes_pendientes_recibidas().count()
-    
-    # Obtener recomendaciones de amigos
-    motor = MotorRecomendaciones()
-    recomendaciones = motor.obtener_recomendaciones(request.user, limite=5)
-    estadisticas_grafo = motor.obtener_estadisticas_grafo(request.user)
+    # Estadísticas, recomendaciones e IDs de amigos (en caché por versión del grafo)
+    datos = cache.get_or_set(
+        clave_dashboard(request.user.id),
+        lambda: _datos_dashboard(request.user),
+        timeout=TIEMPO_CACHE_DASHBOARD
+    )
     
-    # Obtener lista de amigos para mostrar
-    amigos = perfil.obtener_amigos()[:6]
+    # Cargar todos los usuarios a mostrar con una sola consulta
+    usuarios = User.objects.select_related('perfil').in_bulk(
+        [rec[0] for rec in datos['recomendaciones']] + datos['amigos_ids']
+    )
+    recomendaciones = [
+        Recomendacion(usuarios[usuario_id], puntuacion, num_comun, nombres, distancia)
+        for usuario_id, puntuacion, num_comun, nombres, distancia in datos['recomendaciones']
+        if usuario_id in usuarios
+    ]
+    amigos = [usuarios[amigo_id] for amigo_id in datos['amigos_ids'] if amigo_id in usuarios]
     
     context = {
         'perfil': perfil,
-        'num_amigos': num_amigos,
-        'solicitudes_pendientes': solicitudes_pendientes,
+        'num_amigos': datos['num_amigos'],
+        'solicitudes_pendientes': datos['solicitudes_pendientes'],
         'recomendaciones': recomendaciones,
-        'estadisticas_grafo': estadisticas_grafo,
+        'estadisticas_grafo': datos['estadisticas_grafo'],
         'amigos': amigos,
     }
     
@@ -99,12 +177,15 @@ def dashboard_view(request):
 
 
 @login_required
+@revalidar
+@etag(etag_usuario)
 def perfil_view(request, username=None):
     """Vista del perfil de usuario."""
     if username is None:
         user = request.user
     else:
-        user = get_object_or_404(User, username=username)
+        # El perfil viene en la misma consulta que el usuario
+        user = get_object_or_404(User.objects.select_related('perfil'), username=username)
     
     perfil = user.perfil
     es_propio = user == request.user
@@ -117,30 +198,34 @@ def perfil_view(request, username=None):
     if not es_propio:
         son_amigos = Amistad.son_amigos(request.user, user)
         
-        # Verificar si hay solicitud pendiente enviada
-        solicitud_enviada = SolicitudAmistad.objects.filter(
-            de_usuario=request.user,
-            para_usuario=user,
+        # Solicitudes pendientes en ambas direcciones con una sola consulta
+        solicitudes = list(SolicitudAmistad.objects.filter(
+            Q(de_usuario=request.user, para_usuario=user) |
+            Q(de_usuario=user, para_usuario=request.user),
             estado='pendiente'
-        ).exists()
-        
-        # Verificar si hay solicitud pendiente recibida
-        solicitud_recibida = SolicitudAmistad.objects.filter(
-            de_usuario=user,
-            para_usuario=request.user,
-            estado='pendiente'
-        ).first()
-    
-    # Obtener amigos del usuario
-    amigos = perfil.obtener_amigos()
+        ).only('id', 'de_usuario', 'para_usuario'))
+        solicitud_enviada = any(
+            solicitud.de_usuario_id == request.user.id for solicitud in solicitudes
+        )
+        solicitud_recibida = next(
+            (solicitud for solicitud in solicitudes if solicitud.para_usuario_id == request.user.id),
+            None
+        )
+    
+    # Solo se muestran los primeros amigos; el total sale del contador del perfil
+    amigos = list(perfil.obtener_amigos()[:AMIGOS_EN_PERFIL])
     
     # Amigos en común (si no es el propio perfil)
     amigos_comun = []
     if not es_propio:
-        motor = MotorRecomendaciones()
-        motor.grafo.construir_grafo()
+        motor = obtener_motor()
+        # Memorizado por par y versión del grafo; los usuarios se cargan de una vez
         amigos_comun_ids = motor.grafo.amigos_en_comun(request.user.id, user.id)
-        amigos_comun = User.objects.filter(id__in=amigos_comun_ids)
+        if amigos_comun_ids:
+            usuarios_comun = User.objects.select_related('perfil').only(
+                'id', 'username', 'first_name', 'perfil__foto'
+            ).in_bulk(amigos_comun_ids)
+            amigos_comun = [usuarios_comun[i] for i in amigos_comun_ids if i in usuarios_comun]
     
     context = {
         'usuario': user,
@@ -151,7 +236,7 @@ def perfil_view(request, username=None):
         'solicitud_recibida': solicitud_recibida,
         'amigos': amigos,
         'amigos_comun': amigos_comun,
-        'num_amigos': len(amigos),
+        'num_amigos': perfil.contar_amigos(),
     }
     
     return render(request, 'usuarios/perfil.html', context)
@@ -188,6 +273,8 @@ def editar_perfil_view(request):
 # ============== VISTAS DE AMISTADES ==============
 
 @login_required
+@revalidar
+@etag(etag_usuario)
 def lista_amigos_view(request):
     """Vista de la lista de amigos del usuario."""
     perfil = request.user.perfil
@@ -195,23 +282,34 @@ def lista_amigos_view(request):
     
     context = {
         'amigos': amigos,
-        'num_amigos': len(amigos),
+        'num_amigos': perfil.contar_amigos(),
     }
     
     return render(request, 'usuarios/lista_amigos.html', context)
 
 
 @login_required
+@revalidar
+@etag(etag_usuario)
 def solicitudes_view(request):
     """Vista de solicitudes de amistad pendientes."""
+    # El otro usuario y su perfil se cargan en la misma consulta (JOIN)
     solicitudes_recibidas = SolicitudAmistad.objects.filter(
         para_usuario=request.user,
         estado='pendiente'
+    ).select_related('de_usuario__perfil').only(
+        'id', 'fecha_creacion',
+        'de_usuario__username', 'de_usuario__first_name', 'de_usuario__last_name',
+        'de_usuario__perfil__foto'
     ).order_by('-fecha_creacion')
     
     solicitudes_enviadas = SolicitudAmistad.objects.filter(
         de_usuario=request.user,
         estado='pendiente'
+    ).select_related('para_usuario__perfil').only(
+        'id', 'fecha_creacion',
+        'para_usuario__username', 'para_usuario__first_name', 'para_usuario__last_name',
+        'para_usuario__perfil__foto'
     ).order_by('-fecha_creacion')
     
     context = {
@@ -230,35 +328,40 @@ def enviar_solicitud_view(request, user_id):
     # Verificar que no sea el mismo usuario
     if para_usuario == request.user:
         messages.error(request, 'No puedes enviarte una solicitud a ti mismo.')
-        return redirect('perfil', username=para_usuario.username)
+        return redirect('perfil_usuario', username=para_usuario.username)
     
     # Verificar que no sean ya amigos
     if Amistad.son_amigos(request.user, para_usuario):
         messages.info(request, f'Ya eres amigo de {para_usuario.username}.')
-        return redirect('perfil', username=para_usuario.username)
+        return redirect('perfil_usuario', username=para_usuario.username)
     
-    # Verificar que no exista una solicitud pendiente
+    # Verificar que no exista una solicitud pendiente (en cualquier dirección)
     solicitud_existente = SolicitudAmistad.objects.filter(
         Q(de_usuario=request.user, para_usuario=para_usuario) |
         Q(de_usuario=para_usuario, para_usuario=request.user),
         estado='pendiente'
-    ).first()
+    ).only('id', 'de_usuario').first()
     
     if solicitud_existente:
-        if solicitud_existente.de_usuario == request.user:
+        if solicitud_existente.de_usuario_id == request.user.id:
             messages.info(request, 'Ya has enviado una solicitud a este usuario.')
         else:
             messages.info(request, 'Este usuario ya te ha enviado una solicitud. ¡Acéptala!')
-        return redirect('perfil', username=para_usuario.username)
-    
-    # Crear la solicitud
-    SolicitudAmistad.objects.create(
-        de_usuario=request.user,
-        para_usuario=para_usuario
-    )
+        return redirect('perfil_usuario', username=para_usuario.username)
+    
+    # Crear la solicitud; la restricción única cubre el caso de dos envíos simultáneos
+    try:
+        with transaction.atomic():
+            SolicitudAmistad.objects.create(
+                de_usuario=request.user,
+                para_usuario=para_usuario
+            )
+    except IntegrityError:
+        messages.info(request, 'Ya has enviado una solicitud a este usuario.')
+        return redirect('perfil_usuario', username=para_usuario.username)
     
     messages.success(request, f'Solicitud de amistad enviada a {para_usuario.username}.')
-    return redirect('perfil', username=para_usuario.username)
+    return redirect('perfil_usuario', username=para_usuario.username)
 
 
 @login_required
@@ -314,14 +417,11 @@ def eliminar_amigo_view(request, user_id):
     """Vista para eliminar un amigo."""
     amigo = get_object_or_404(User, id=user_id)
     
-    # Buscar y eliminar la amistad
-    amistad = Amistad.objects.filter(
-        Q(usuario1=request.user, usuario2=amigo) |
-        Q(usuario1=amigo, usuario2=request.user)
-    ).first()
+    # Eliminar la amistad directamente; el par se guarda en orden canónico
+    usuario1, usuario2 = Amistad.ordenar_par(request.user, amigo)
+    eliminadas, _ = Amistad.objects.filter(usuario1=usuario1, usuario2=usuario2).delete()
     
-    if amistad:
-        amistad.delete()
+    if eliminadas:
         messages.info(request, f'Has eliminado a {amigo.username} de tu lista de amigos.')
     else:
         messages.error(request, 'No eres amigo de este usuario.')
@@ -332,20 +432,70 @@ def eliminar_amigo_view(request, user_id):
 # ============== VISTAS DE RECOMENDACIONES ==============
 
 @login_required
+@revalidar
+@etag(etag_usuario)
 def recomendaciones_view(request):
-    """Vista de recomendaciones inteligentes de amigos."""
-    motor = MotorRecomendaciones()
-    recomendaciones = motor.obtener_recomendaciones(request.user, limite=20)
+    """
+    Vista de recomendaciones inteligentes de amigos.
+    
+    Solo renderiza la primera página; el resto se carga desde
+    recomendaciones_api_view a medida que el usuario se desplaza.
+    """
+    motor = obtener_motor()
+    recomendaciones = motor.obtener_recomendaciones(
+        request.user, limite=RECOMENDACIONES_POR_PAGINA
+    )
     estadisticas = motor.obtener_estadisticas_grafo(request.user)
     
     context = {
         'recomendaciones': recomendaciones,
         'estadisticas': estadisticas,
+        'hay_mas': len(recomendaciones) == RECOMENDACIONES_POR_PAGINA,
     }
     
     return render(request, 'usuarios/recomendaciones.html', context)
 
 
+@login_required
+@revalidar
+@etag(etag_usuario)
+def recomendaciones_api_view(request):
+    """Página de recomendaciones en JSON (?desde=N) para la carga incremental."""
+    try:
+        desde = max(int(request.GET.get('desde', 0)), 0)
+    except ValueError:
+        desde = 0
+    
+    limite = min(RECOMENDACIONES_POR_PAGINA, MAX_RECOMENDACIONES - desde)
+    recomendaciones = []
+    if limite > 0:
+        recomendaciones = obtener_motor().obtener_recomendaciones(
+            request.user, limite=limite, desplazamiento=desde
+        )
+    
+    items = []
+    for rec in recomendaciones:
+        usuario = rec.usuario
+        items.append({
+            'id': usuario.id,
+            'username': usuario.username,
+            'nombre': f'{usuario.first_name} {usuario.last_name}',
+            'foto': usuario.perfil.foto.url if usuario.perfil.foto else None,
+            'puntuacion': rec.puntuacion,
+            'num_amigos_comun': rec.num_amigos_comun,
+            'amigos_comun_nombres': rec.amigos_comun_nombres,
+            'distancia': rec.distancia,
+            'url_perfil': reverse('perfil_usuario', args=[usuario.username]),
+            'url_enviar': reverse('enviar_solicitud', args=[usuario.id]),
+        })
+    
+    siguiente = desde + len(items)
+    return JsonResponse({
+        'items': items,
+        'siguiente': siguiente if len(items) == limite and siguiente < MAX_RECOMENDACIONES else None,
+    })
+
+
 # ============== VISTAS DE BÚSQUEDA ==============
 
 @login_required
@@ -358,32 +508,44 @@ def buscar_usuarios_view(request):
     if form.is_valid():
         query = form.cleaned_data.get('query', '')
         if query:
-            resultados = User.objects.filter(
+            resultados = list(User.objects.filter(
                 Q(username__icontains=query) |
                 Q(first_name__icontains=query) |
                 Q(last_name__icontains=query)
-            ).exclude(id=request.user.id)[:20]
-    
-    # Agregar información de estado de amistad para cada resultado
-    resultados_con_estado = []
-    for user in resultados:
-        es_amigo = Amistad.son_amigos(request.user, user)
-        solicitud_enviada = SolicitudAmistad.objects.filter(
+            ).exclude(id=request.user.id).select_related('perfil').only(
+                'id', 'username', 'first_name', 'last_name',
+                'perfil__foto', 'perfil__ubicacion'
+            )[:20])
+    
+    # Precalcular el estado de amistad de todos los resultados (3 consultas)
+    ids = [user.id for user in resultados]
+    amigos_ids = frozenset()
+    enviadas_ids = set()
+    recibidas_ids = set()
+    
+    if ids:
+        amigos_ids = Amistad.ids_amigos(request.user)
+        
+        enviadas_ids = set(SolicitudAmistad.objects.filter(
             de_usuario=request.user,
-            para_usuario=user,
+            para_usuario__in=ids,
             estado='pendiente'
-        ).exists()
-        solicitud_recibida = SolicitudAmistad.objects.filter(
-            de_usuario=user,
+        ).values_list('para_usuario_id', flat=True))
+        
+        recibidas_ids = set(SolicitudAmistad.objects.filter(
+            de_usuario__in=ids,
             para_usuario=request.user,
             estado='pendiente'
-        ).exists()
-        
+        ).values_list('de_usuario_id', flat=True))
+    
+    # Agregar información de estado de amistad para cada resultado
+    resultados_con_estado = []
+    for user in resultados:
         resultados_con_estado.append({
             'usuario': user,
-            'es_amigo': es_amigo,
-            'solicitud_enviada': solicitud_enviada,
-            'solicitud_recibida': solicitud_recibida,
+            'es_amigo': user.id in amigos_ids,
+            'solicitud_enviada': user.id in enviadas_ids,
+            'solicitud_recibida': user.id in recibidas_ids,
         })
     
     context = {